@@ -0,0 +1,159 @@
+import os
+import numpy as np
+import pandas as pd
+from matcher import UniversityMatcher
+from writers import TIMEZONE
+
+# Файлы с накопленными дневными агрегатами по университетам и по каналам по умолчанию
+DAILY_AGGREGATES_PATH = 'daily_aggregates.csv'
+DAILY_CHANNEL_AGGREGATES_PATH = 'daily_aggregates_channel.csv'
+DAILY_AGGREGATES_PATHS = {'university': DAILY_AGGREGATES_PATH, 'channel': DAILY_CHANNEL_AGGREGATES_PATH}
+# Суммируемые показатели: из них вычисляются все остальные
+SUM_COLUMNS = ['posts', 'views', 'forwards']
+LEVELS = ('university', 'channel')
+
+
+def prepare(df, matcher=None):
+    """Подготавливает собранные данные к агрегации
+
+    Колонка university в собранных данных содержит название канала, поэтому
+    она переносится в channel, а university заполняется классификатором
+    (названия классифицируются по одному разу, а не для каждой строки).
+    Добавляется колонка date - день публикации по московскому времени.
+    """
+    if matcher is None:
+        matcher = UniversityMatcher.from_file()
+    result = pd.DataFrame({
+        'channel': df['university'].astype(str),
+        'date': pd.to_datetime(df['publication_date'], utc=True)
+                  .dt.tz_convert(TIMEZONE).dt.tz_localize(None).dt.normalize(),
+        'views': df['views'].fillna(0).astype(np.int64),
+        'forwards': df['forwards'].fillna(0).astype(np.int64),
+    })
+    titles = result['channel'].unique()
+    # Каналы, не найденные в конфигурации, считаются отдельными университетами
+    universities = pd.Series([matcher.classify(title) or title for title in titles], index=titles)
+    result['university'] = result['channel'].map(universities)
+    return result
+
+
+def daily_counts(prepared, level='university'):
+    """Суммы публикаций, просмотров и репостов по дням для university или channel"""
+    if level not in LEVELS:
+        raise ValueError(f"Неизвестный уровень агрегации: {level}. Доступны: {', '.join(LEVELS)}")
+    grouped = prepared.groupby([level, 'date'], sort=True)
+    daily = grouped[['views', 'forwards']].sum()
+    daily.insert(0, 'posts', grouped.size())
+    return daily[SUM_COLUMNS]
+
+
+def merge_daily(daily, new_daily):
+    """Заменяет в накопленных агрегатах дни групп, пересчитанные в new_daily
+
+    Агрегаты остальных дней не пересчитываются, а повторное объединение
+    с теми же данными не меняет результат.
+    """
+    if daily is None or daily.empty:
+        return new_daily.sort_index()
+    return new_daily.combine_first(daily)[SUM_COLUMNS].astype(np.int64).sort_index()
+
+
+def add_rates(aggregates):
+    """Добавляет производные показатели: просмотры на пост и вовлеченность
+
+    Вовлеченность - доля репостов от просмотров (0, если просмотров нет).
+    """
+    result = aggregates.copy()
+    posts = result['posts'].to_numpy(dtype=float)
+    views = result['views'].to_numpy(dtype=float)
+    forwards = result['forwards'].to_numpy(dtype=float)
+    result['views_per_post'] = np.divide(views, posts, out=np.zeros_like(views), where=posts > 0)
+    result['engagement_rate'] = np.divide(forwards, views, out=np.zeros_like(views), where=views > 0)
+    return result
+
+
+def weekly_counts(daily):
+    """Недельные суммы (недели с понедельника) из дневных агрегатов"""
+    level = daily.index.names[0]
+    return (daily.reset_index()
+            .groupby([level, pd.Grouper(key='date', freq='W-MON', label='left', closed='left')])
+            [SUM_COLUMNS].sum())
+
+
+def rolling_metrics(daily, window=7):
+    """Скользящие показатели за window дней
+
+    Дневные агрегаты разворачиваются в матрицу «дата x группа» с нулями в
+    днях без публикаций, после чего окно считается сразу по всем группам.
+    """
+    level = daily.index.names[0]
+    dates = daily.index.get_level_values('date')
+    full_range = pd.date_range(dates.min(), dates.max(), freq='D', name='date')
+    sums = {}
+    for column in SUM_COLUMNS:
+        wide = daily[column].unstack(level=0).reindex(full_range).fillna(0)
+        sums[column] = wide.rolling(window, min_periods=1).sum()
+    rolled = pd.concat({column: sums[column].stack() for column in SUM_COLUMNS}, axis=1)
+    rolled = rolled.reorder_levels([level, 'date']).sort_index()
+    rolled.columns = [f'{column}_{window}d' for column in SUM_COLUMNS]
+    views = rolled[f'views_{window}d'].to_numpy(dtype=float)
+    forwards = rolled[f'forwards_{window}d'].to_numpy(dtype=float)
+    rolled[f'engagement_rate_{window}d'] = np.divide(forwards, views, out=np.zeros_like(views),
+                                                     where=views > 0)
+    return rolled
+
+
+def build_aggregates(daily, window=7):
+    """Полный набор агрегатов из дневных сумм одного уровня"""
+    return {
+        'daily': add_rates(daily),
+        'weekly': add_rates(weekly_counts(daily)),
+        'rolling': rolling_metrics(daily, window),
+    }
+
+
+def load_daily(path=DAILY_AGGREGATES_PATH):
+    """Загружает накопленные дневные агрегаты или None, если файла нет"""
+    if not os.path.exists(path):
+        return None
+    daily = pd.read_csv(path, parse_dates=['date'])
+    level = daily.columns[0]
+    return daily.set_index([level, 'date'])[SUM_COLUMNS]
+
+
+def load_daily_levels(paths=DAILY_AGGREGATES_PATHS):
+    """Накопленные дневные агрегаты всех уровней {уровень: таблица} или None, если файла нет"""
+    daily = {level: load_daily(path) for level, path in paths.items()}
+    return None if any(table is None for table in daily.values()) else daily
+
+
+def _save_daily(prepared, path, level, days=None, replace=False):
+    if days is not None:
+        prepared = prepared[prepared['date'].isin(pd.to_datetime(sorted(days)))]
+    daily = daily_counts(prepared, level)
+    if not replace:
+        daily = merge_daily(load_daily(path), daily)
+    daily.to_csv(path)
+    return daily
+
+
+def update_daily(rows, path=DAILY_AGGREGATES_PATH, level='university', matcher=None, days=None):
+    """Пересчитывает сохраненные дневные агрегаты только для дней из rows
+
+    rows должны содержать все сообщения своих дней (например, выборку
+    собранных данных за дни, в которые были записаны новые сообщения):
+    агрегаты этих дней заменяются, остальные берутся из path. Если
+    заданы days (строки YYYY-MM-DD), учитываются только эти дни.
+    Возвращает обновленные дневные агрегаты и сохраняет их в path.
+    """
+    return _save_daily(prepare(rows, matcher), path, level, days)
+
+
+def update_daily_levels(rows, paths=DAILY_AGGREGATES_PATHS, matcher=None, days=None, replace=False):
+    """Обновляет дневные агрегаты всех уровней paths ({уровень: файл}), как update_daily
+
+    Данные подготавливаются один раз для всех уровней. С replace файлы
+    строятся заново только по rows. Возвращает {уровень: агрегаты}.
+    """
+    prepared = prepare(rows, matcher)
+    return {level: _save_daily(prepared, path, level, days, replace) for level, path in paths.items()}
@@ -1,35 +1,57 @@
 from telethon import TelegramClient
 from telethon.errors import AuthRestartError, FloodWaitError, SessionPasswordNeededError
-import time
 import os
 from dotenv import load_dotenv
 import asyncio
 
-def get_env_value(key, prompt):
+def is_interactive():
+    """Разрешен ли ввод с клавиатуры (NON_INTERACTIVE=1 отключает его для запусков по расписанию)"""
+    return os.getenv('NON_INTERACTIVE') != '1'
+
+def get_env_value(key, prompt, interactive=True):
     """Получает значение из .env или запрашивает у пользователя"""
     value = os.getenv(key)
     if not value or value == f'your_{key.lower()}_here' or value == 'your_phone_number_here':
+        if not interactive:
+            raise ValueError(f"Переменная {key} не задана в .env")
         value = input(prompt)
-        # Обновляем .env файл
-        with open('.env', 'r') as file:
-            lines = file.readlines()
-        with open('.env', 'w') as file:
-            for line in lines:
-                if line.startswith(f'{key}='):
-                    file.write(f'{key}={value}\n')
-                else:
-                    file.write(line)
+        # Обновляем .env файл, если он есть
+        if os.path.exists('.env'):
+            with open('.env', 'r') as file:
+                lines = file.readlines()
+            with open('.env', 'w') as file:
+                for line in lines:
+                    if line.startswith(f'{key}='):
+                        file.write(f'{key}={value}\n')
+                    else:
+                        file.write(line)
     return value
 
-async def authenticate_client():
-    """Аутентификация клиента Telegram"""
+async def authenticate_client(session_name='session_name', phone_key='PHONE', interactive=None):
+    """Аутентификация клиента Telegram
+
+    Номер телефона для сессии session_name берется из переменной phone_key.
+    В неинтерактивном режиме (interactive=False или NON_INTERACTIVE=1)
+    используется только сохраненный файл сессии: ввод с клавиатуры не
+    запрашивается, а неавторизованная сессия приводит к ошибке.
+    Ввод и запись .env выполняются в отдельном потоке, чтобы не
+    блокировать цикл событий.
+    """
     # Загрузка переменных окружения
     load_dotenv()
+    if interactive is None:
+        interactive = is_interactive()
     
     # Получение данных для авторизации
-    api_id = get_env_value('API_ID', 'Введите ваш API_ID (число): ')
-    api_hash = get_env_value('API_HASH', 'Введите ваш API_HASH (строка): ')
-    phone = get_env_value('PHONE', 'Введите ваш номер телефона в формате +7XXXXXXXXXX: ')
+    api_id = await asyncio.to_thread(get_env_value, 'API_ID', 'Введите ваш API_ID (число): ', interactive)
+    api_hash = await asyncio.to_thread(get_env_value, 'API_HASH', 'Введите ваш API_HASH (строка): ', interactive)
+    if interactive:
+        phone = await asyncio.to_thread(
+            get_env_value, phone_key,
+            f'Введите номер телефона для сессии {session_name} в формате +7XXXXXXXXXX: ')
+    elif not os.path.exists(f'{session_name}.session'):
+        raise ValueError(f"Файл сессии {session_name}.session не найден. "
+                         "Сначала выполните авторизацию в интерактивном режиме")
 
     # Проверка корректности всех введенных значений
     try:
@@ -42,7 +64,9 @@ async def authenticate_client():
     if not api_hash or api_hash == 'your_api_hash_here':
         raise ValueError("API_HASH не может быть пустым")
 
-    if not phone or phone == 'your_phone_number_here':
+    if not interactive:
+        pass
+    elif not phone or phone == 'your_phone_number_here':
         raise ValueError("Номер телефона не может быть пустым")
     elif not phone.startswith('+7') or len(phone) != 12:
         raise ValueError("Номер телефона должен быть в формате +7XXXXXXXXXX")
@@ -51,14 +75,16 @@ async def authenticate_client():
     
     # Создание клиента с информацией об устройстве
     client = TelegramClient(
-        'session_name',
+        session_name,
         api_id,
         api_hash,
         device_model="Desktop",
         system_version="Windows 10",
         app_version="2.0",
         lang_code="en",
-        system_lang_code="en-US"
+        system_lang_code="en-US",
+        # FloodWait во время сбора обрабатывает планировщик запросов
+        flood_sleep_threshold=0
     )
     
     max_retries = 3
@@ -73,6 +99,9 @@ async def authenticate_client():
             await client.connect()
             
             if not await client.is_user_authorized():
+                if not interactive:
+                    raise ValueError(f"Сессия {session_name} не авторизована. "
+                                     "Выполните авторизацию в интерактивном режиме")
                 try:
                     print("Отправляем запрос на получение кода...")
                     await client.send_code_request(phone)
@@ -89,7 +118,7 @@ async def authenticate_client():
                           "4. Проверьте, не заблокирован ли ваш номер в Telegram")
                     
                     # Ждем ввода кода
-                    code = input("\nВведите код из Telegram/SMS: ")
+                    code = await asyncio.to_thread(input, "\nВведите код из Telegram/SMS: ")
                     
                     try:
                         # Пытаемся войти с кодом
@@ -98,7 +127,7 @@ async def authenticate_client():
                     except SessionPasswordNeededError:
                         print("\nВключена двухфакторная аутентификация!\n"
                               "Введите пароль двухфакторной аутентификации:")
-                        password = input("Пароль: ")
+                        password = await asyncio.to_thread(input, "Пароль: ")
                         await client.sign_in(password=password)
                         print("Авторизация успешна!")
                 except FloodWaitError as e:
@@ -117,10 +146,56 @@ async def authenticate_client():
             retry_count += 1
             if retry_count < max_retries:
                 print(f"\nОшибка авторизации. Подождите {wait_time} секунд перед следующей попыткой...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
                 wait_time *= 2  # Увеличиваем время ожидания с каждой попыткой
             else:
                 raise Exception("Не удалось авторизоваться после нескольких попыток. Попробуйте позже.")
         except Exception as e:
             print(f"Произошла ошибка: {str(e)}")
-            raise Exception(f"Ошибка при авторизации: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Ошибка при авторизации: {str(e)}")
+
+def get_session_names():
+    """Имена сессий из переменной SESSIONS (через запятую), по умолчанию одна сессия"""
+    load_dotenv()
+    names = [name.strip() for name in os.getenv('SESSIONS', '').split(',') if name.strip()]
+    return names or ['session_name']
+
+def get_phone_key(session_name, all_names):
+    """Переменная с номером телефона: PHONE для первой сессии, PHONE_<ИМЯ> для остальных"""
+    return 'PHONE' if session_name == all_names[0] else f'PHONE_{session_name.upper()}'
+
+async def authenticate_clients(session_names, all_names=None, interactive=None):
+    """Аутентификация нескольких аккаунтов
+
+    all_names - полный список сессий (если здесь авторизуется только часть).
+    В интерактивном режиме сессии авторизуются по очереди, так как могут
+    запрашивать код с клавиатуры, а в неинтерактивном - одновременно.
+    Возвращает список пар (имя сессии, клиент).
+    """
+    all_names = all_names or session_names
+    if interactive is None:
+        interactive = is_interactive()
+    clients = []
+    try:
+        if interactive:
+            for session_name in session_names:
+                print(f"\nАвторизация сессии {session_name}...")
+                client = await authenticate_client(session_name, get_phone_key(session_name, all_names),
+                                                   interactive=True)
+                clients.append((session_name, client))
+        else:
+            results = await asyncio.gather(
+                *(authenticate_client(session_name, get_phone_key(session_name, all_names),
+                                      interactive=False)
+                  for session_name in session_names),
+                return_exceptions=True)
+            clients = [(session_name, result) for session_name, result in zip(session_names, results)
+                       if not isinstance(result, BaseException)]
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                raise errors[0]
+    except Exception:
+        for _, client in clients:
+            await client.disconnect()
+        raise
+    return clients
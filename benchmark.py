@@ -0,0 +1,132 @@
+"""Замер производительности сбора данных на локальной замене Telegram
+
+Запускает collect_telegram_data целиком на FakeTelegramClient и выводит
+скорость (сообщений в секунду), пиковое потребление памяти процесса и
+время до первой записи в файл. С параметром --baseline сравнивает
+результат с сохраненным и завершается с кодом 1 при ухудшении больше
+чем на --tolerance.
+
+Пример:
+    python benchmark.py --channels 50 --messages 5000 --latency 0.01 --save baseline.json
+    python benchmark.py --channels 50 --messages 5000 --latency 0.01 --baseline baseline.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from data_collector import collect_telegram_data
+from fake_telegram import FakeTelegramClient
+from metrics import Metrics
+from scheduler import RequestScheduler
+
+# Интервал проверки появления выходного файла, в секундах
+POLL_INTERVAL = 0.001
+
+
+def peak_rss_mb():
+    """Пиковый объем памяти процесса в МБ или None, если недоступен (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # В Linux значение в килобайтах, в macOS - в байтах
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+async def _wait_first_write(path, started):
+    while not (os.path.exists(path) and os.path.getsize(path) > 0):
+        await asyncio.sleep(POLL_INTERVAL)
+    return time.perf_counter() - started
+
+
+async def run_benchmark(channels=10, messages=1000, days=60, latency=0.0, flood_every=None,
+                        concurrency=5, output_format='csv', rate=1000.0):
+    """Один прогон сбора данных; возвращает словарь с результатами замера"""
+    client = FakeTelegramClient(channels=channels, messages_per_channel=messages, days=days,
+                                latency=latency, flood_every=flood_every)
+    # Ограничение скорости не должно искажать замер самого конвейера
+    scheduler = RequestScheduler(rate=rate, max_rate=rate, min_rate=rate, burst=int(rate))
+    metrics = Metrics()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'telegram_stats.csv' if output_format == 'csv' else 'stats')
+        started = time.perf_counter()
+        first_write = asyncio.create_task(_wait_first_write(path, started))
+        with contextlib.redirect_stdout(io.StringIO()):
+            df = await collect_telegram_data(client, max_concurrency=concurrency, scheduler=scheduler,
+                                             output_format=output_format, output_path=path,
+                                             columns=['views'], metrics=metrics)
+        elapsed = time.perf_counter() - started
+        time_to_first_write = first_write.result() if first_write.done() else None
+        first_write.cancel()
+    rows = 0 if df is None else len(df)
+    peak = peak_rss_mb()
+    return {
+        'channels': channels,
+        'messages_per_channel': messages,
+        'rows': rows,
+        'requests': client.requests,
+        'flood_waits': client.flood_waits,
+        'seconds': round(elapsed, 4),
+        'messages_per_sec': round(rows / elapsed, 1) if elapsed else None,
+        'time_to_first_write': round(time_to_first_write, 4) if time_to_first_write is not None else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'stages': metrics.to_dict()['stages'],
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Список ухудшений относительно baseline больше чем на tolerance"""
+    regressions = []
+    checks = [('messages_per_sec', False), ('time_to_first_write', True), ('peak_rss_mb', True)]
+    for key, lower_is_better in checks:
+        old, new = baseline.get(key), result.get(key)
+        if not old or new is None:
+            continue
+        if lower_is_better and new > old * (1 + tolerance):
+            regressions.append(f"{key}: {old} -> {new}")
+        elif not lower_is_better and new < old * (1 - tolerance):
+            regressions.append(f"{key}: {old} -> {new}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замер производительности сбора данных без сети")
+    parser.add_argument('--channels', type=int, default=10, help="количество каналов")
+    parser.add_argument('--messages', type=int, default=1000, help="сообщений в каждом канале")
+    parser.add_argument('--days', type=int, default=60, help="за сколько дней распределены сообщения")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка одного запроса, с")
+    parser.add_argument('--flood-every', type=int, default=None, help="FloodWait на каждом N-м запросе")
+    parser.add_argument('--concurrency', type=int, default=5, help="число воркеров")
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help="формат вывода")
+    parser.add_argument('--save', help="сохранить результат в JSON-файл")
+    parser.add_argument('--baseline', help="JSON-файл с результатом для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимое ухудшение (доля)")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run_benchmark(
+        channels=args.channels, messages=args.messages, days=args.days, latency=args.latency,
+        flood_every=args.flood_every, concurrency=args.concurrency, output_format=args.format))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(result, json.load(file), args.tolerance)
+        if regressions:
+            print("Обнаружено ухудшение производительности:\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+# Файл с контрольными точками по умолчанию
+CHECKPOINTS_PATH = 'checkpoints.sqlite'
+
+# Сколько дней после публикации обновляются счетчики просмотров и репостов
+COUNTER_REFRESH_DAYS = 3
+
+
+class CheckpointStore:
+    """Хранилище контрольных точек инкрементального сбора
+
+    Для каждого канала хранится id последнего полученного сообщения,
+    а для недавних сообщений - их счетчики, которые еще меняются.
+    Изменения сохраняются на диск только после вызова commit(), чтобы
+    контрольная точка не опережала записанные данные.
+    """
+
+    def __init__(self, path=CHECKPOINTS_PATH, refresh_days=COUNTER_REFRESH_DAYS):
+        self.path = path
+        self.refresh_days = refresh_days
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS channels (
+                channel_id INTEGER PRIMARY KEY,
+                last_message_id INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS message_counters (
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                publication_date TEXT NOT NULL,
+                views INTEGER NOT NULL,
+                forwards INTEGER NOT NULL,
+                PRIMARY KEY (channel_id, message_id)
+            );
+        """)
+        self.connection.commit()
+
+    def get_last_message_id(self, channel_id):
+        """Возвращает id последнего полученного сообщения канала или None"""
+        row = self.connection.execute(
+            "SELECT last_message_id FROM channels WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_last_message_id(self, channel_id, message_id):
+        """Сдвигает контрольную точку канала вперед"""
+        self.connection.execute(
+            """INSERT INTO channels (channel_id, last_message_id, updated_at)
+               VALUES (?, ?, ?)
+               ON CONFLICT(channel_id) DO UPDATE SET
+                   last_message_id = MAX(last_message_id, excluded.last_message_id),
+                   updated_at = excluded.updated_at""",
+            (channel_id, message_id, datetime.now(timezone.utc).isoformat())
+        )
+
+    def track_counters(self, channel_id, message_id, publication_date, views, forwards):
+        """Запоминает счетчики сообщения для последующего обновления"""
+        self.connection.execute(
+            """INSERT INTO message_counters
+                   (channel_id, message_id, publication_date, views, forwards)
+               VALUES (?, ?, ?, ?, ?)
+               ON CONFLICT(channel_id, message_id) DO UPDATE SET
+                   views = excluded.views,
+                   forwards = excluded.forwards""",
+            (channel_id, message_id, publication_date.astimezone(timezone.utc).isoformat(),
+             views, forwards)
+        )
+
+    def get_refresh_ids(self, channel_id):
+        """Возвращает id сообщений, счетчики которых еще нужно обновлять
+
+        Сообщения старше refresh_days больше не отслеживаются и удаляются.
+        """
+        border = (datetime.now(timezone.utc) - timedelta(days=self.refresh_days)).isoformat()
+        self.connection.execute(
+            "DELETE FROM message_counters WHERE channel_id = ? AND publication_date < ?",
+            (channel_id, border)
+        )
+        rows = self.connection.execute(
+            "SELECT message_id FROM message_counters WHERE channel_id = ? ORDER BY message_id",
+            (channel_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_counters(self, channel_id):
+        """Возвращает актуальные счетчики отслеживаемых сообщений канала"""
+        rows = self.connection.execute(
+            """SELECT message_id, views, forwards FROM message_counters
+               WHERE channel_id = ? ORDER BY message_id""",
+            (channel_id,)
+        ).fetchall()
+        return {message_id: (views, forwards) for message_id, views, forwards in rows}
+
+    def update_counters(self, channel_id, message_id, views, forwards):
+        """Обновляет счетчики уже отслеживаемого сообщения"""
+        self.connection.execute(
+            """UPDATE message_counters SET views = ?, forwards = ?
+               WHERE channel_id = ? AND message_id = ?""",
+            (views, forwards, channel_id, message_id)
+        )
+
+    def commit(self):
+        """Сохраняет накопленные изменения на диск"""
+        self.connection.commit()
+
+    def rollback(self):
+        """Отменяет изменения, не сохраненные через commit()"""
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
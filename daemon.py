@@ -0,0 +1,241 @@
+import asyncio
+from contextlib import nullcontext
+from functools import partial
+import pytz
+from telethon import events
+from checkpoints import CheckpointStore
+from data_collector import (MessageRecord, message_row, refresh_counters, iter_university_dialogs,
+                            resolve_date_range, row_columns, _channel_worker,
+                            MAX_CONCURRENT_CHANNELS, WRITE_BATCH_SIZE, DEFAULT_LOOKBACK_DAYS,
+                            TIMEZONE)
+from scheduler import RequestScheduler
+from writers import make_writer
+from matcher import UniversityMatcher
+
+# Как часто новые сообщения передаются на запись, в секундах
+FLUSH_INTERVAL = 5
+# Как часто обновляются счетчики недавних сообщений, в секундах
+SWEEP_INTERVAL = 15 * 60
+# Пауза между каналами при обновлении счетчиков, в секундах
+SWEEP_PAUSE = 1.0
+
+
+class LiveChannels:
+    """Сообщения из обновлений Telegram, ожидающие записи
+
+    Обработчики событий только складывают сообщения в буфер, а запись
+    и контрольные точки обновляются в flush(), поэтому обработка
+    обновлений не ждет диска и запросов к API. С media (MediaCollector)
+    сохраняются и сообщения с вложениями без текста, а файлы вложений
+    загружаются через client и scheduler перед записью.
+    """
+
+    def __init__(self, channels, checkpoints, writer=None, metrics=None, media=None, client=None,
+                 scheduler=None):
+        self.channels = {channel.id: channel for channel in channels}
+        self.checkpoints = checkpoints
+        self.writer = writer
+        self.metrics = metrics
+        self.media = media
+        # Вложения Telethon нужны в записях только для загрузки файлов в кэш
+        self.keep_media = media is not None and media.cache is not None
+        self.client = client
+        self.scheduler = scheduler
+        self.new_messages = []
+        self.edited_messages = []
+        self.tz = pytz.timezone(TIMEZONE)
+
+    async def on_new_message(self, event):
+        if event.chat_id in self.channels:
+            self.new_messages.append((event.chat_id,
+                                      MessageRecord.from_message(event.message, self.keep_media)))
+
+    async def on_message_edited(self, event):
+        if event.chat_id in self.channels:
+            self.edited_messages.append((event.chat_id, MessageRecord.from_message(event.message)))
+
+    async def flush(self, batches):
+        """Передает накопленные сообщения на запись
+
+        Сообщения не новее контрольной точки канала уже получены при
+        догрузке истории и пропускаются. У отредактированных сообщений
+        обновляются отслеживаемые счетчики. Возвращает число строк.
+        """
+        new_messages, self.new_messages = self.new_messages, []
+        edited_messages, self.edited_messages = self.edited_messages, []
+        for channel_id, record in edited_messages:
+            self.checkpoints.update_counters(channel_id, record.id, record.views, record.forwards)
+
+        rows = []
+        items = []
+        newest = {}
+        for channel_id, record in new_messages:
+            last_message_id = newest.get(channel_id, self.checkpoints.get_last_message_id(channel_id))
+            if last_message_id is not None and record.id <= last_message_id:
+                continue
+            newest[channel_id] = record.id
+            channel = self.channels[channel_id]
+            if self.metrics is not None:
+                self.metrics.increment('messages', channel=channel.title)
+            # Пропускаем сообщения без текста, а при сборе медиа - и без вложений
+            if record.text or (self.media is not None and record.media_type is not None):
+                rows.append(message_row(channel, record, self.tz, self.media is not None))
+                if self.media is not None:
+                    items.append((channel, rows[-1], record))
+                self.checkpoints.track_counters(channel_id, record.id, record.date,
+                                                record.views, record.forwards)
+                if self.metrics is not None:
+                    self.metrics.increment('rows', channel=channel.title)
+                    if record.text:
+                        self.metrics.increment('bytes', len(record.text.encode('utf-8')),
+                                               channel=channel.title)
+        if items:
+            await self.media.attach(self.client, self.scheduler, items)
+
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            await batches.put(rows[start:start + WRITE_BATCH_SIZE])
+        # Контрольные точки сдвигаются после постановки строк в очередь записи,
+        # а сохраняются только после их записи
+        for channel_id, message_id in newest.items():
+            self.checkpoints.set_last_message_id(channel_id, message_id)
+        if self.writer is not None:
+            for channel_id in {channel_id for channel_id, _ in edited_messages}:
+                await batches.put(partial(self.writer.sync_counters, self.checkpoints, channel_id))
+        if newest or edited_messages:
+            await batches.put(self.checkpoints.commit)
+        if rows:
+            print(f"Получено {len(rows)} новых сообщений")
+        return len(rows)
+
+
+async def _flush_loop(live, batches, writer_task, interval):
+    """Периодически передает новые сообщения на запись"""
+    while True:
+        await asyncio.sleep(interval)
+        if writer_task.done():
+            # Запись завершилась с ошибкой: дальше работать нет смысла
+            writer_task.result()
+            return
+        await live.flush(batches)
+
+
+async def _sweep_loop(client, channels, checkpoints, scheduler, writer, batches, interval, pause):
+    """Фоновое обновление счетчиков недавних сообщений
+
+    Каналы обходятся по одному с паузами, чтобы обновление счетчиков
+    занимало малую часть лимита запросов.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for channel in channels:
+            try:
+                await refresh_counters(client, channel, checkpoints, scheduler)
+            except Exception as e:
+                print(f"Ошибка при обновлении счетчиков {channel.title}: {str(e)}")
+            await batches.put(partial(writer.sync_counters, checkpoints, channel.id))
+            await batches.put(checkpoints.commit)
+            await asyncio.sleep(pause)
+
+
+async def run_daemon(client, checkpoints=None, scheduler=None, output_format='csv', output_path=None,
+                     matcher=None, max_concurrency=MAX_CONCURRENT_CHANNELS,
+                     flush_interval=FLUSH_INTERVAL, sweep_interval=SWEEP_INTERVAL,
+                     metrics=None, stop=None, media=None, start_date=None,
+                     lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """Постоянный сбор данных по обновлениям Telegram вместо повторных обходов
+
+    Находит каналы университетов, подписывается на новые и отредактированные
+    сообщения в них, догружает историю с прошлого запуска и затем
+    дописывает новые сообщения каждые flush_interval секунд. Счетчики
+    просмотров и репостов недавних сообщений обновляются в фоне каждые
+    sweep_interval секунд, если формат вывода позволяет их записать
+    (хранилище SQLite). Работает до отключения клиента или установки
+    события stop. С media собираются метаданные и файлы вложений.
+    История догружается начиная с start_date, по умолчанию за последние
+    lookback_days дней (см. resolve_date_range). Конец периода не
+    ограничивается: сообщения, опубликованные во время поиска каналов, до
+    подписки на обновления, тоже догружаются.
+    """
+    date_range = (resolve_date_range(start_date, None, lookback_days)[0], None)
+    if checkpoints is None:
+        checkpoints = CheckpointStore()
+    if matcher is None:
+        matcher = UniversityMatcher.from_file()
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    if metrics is not None:
+        scheduler.attach_metrics(metrics)
+
+    writer = make_writer(output_format, output_path, append=True, metrics=metrics)
+    try:
+        # Несовпадение колонок обнаруживается до поиска каналов и загрузки сообщений
+        writer.check_columns(row_columns(media is not None))
+        print("\nНачинаем поиск каналов и групп...")
+        channels = [dialog async for dialog in iter_university_dialogs(client, scheduler, matcher)]
+    except BaseException:
+        writer.close()
+        raise
+    if not channels:
+        print("\nНе найдено каналов университетов")
+        writer.close()
+        return
+    if metrics is not None:
+        metrics.increment('channels_found', len(channels))
+
+    live = LiveChannels(channels, checkpoints, writer, metrics, media, client, scheduler)
+    chat_ids = [channel.id for channel in channels]
+    handlers = [(live.on_new_message, events.NewMessage(chats=chat_ids)),
+                (live.on_message_edited, events.MessageEdited(chats=chat_ids))]
+    # Подписка оформляется до догрузки истории, чтобы не потерять сообщения между ними
+    for callback, event in handlers:
+        client.add_event_handler(callback, event)
+
+    batches = asyncio.Queue(maxsize=max_concurrency * 2)
+    writer_task = asyncio.create_task(writer.run(batches))
+    tasks = []
+    try:
+        # Догрузка сообщений, опубликованных с прошлого запуска
+        queue = asyncio.Queue()
+        for channel in channels:
+            queue.put_nowait(channel)
+        workers = [asyncio.create_task(_channel_worker(client, queue, batches, checkpoints,
+                                                       scheduler, metrics, writer, date_range,
+                                                       media))
+                   for _ in range(min(max_concurrency, len(channels)))]
+        for _ in workers:
+            queue.put_nowait(None)
+        with metrics.stage('history') if metrics is not None else nullcontext():
+            await asyncio.gather(*workers)
+
+        print(f"\nОжидание новых сообщений в {len(channels)} каналах...")
+        tasks = [asyncio.create_task(_flush_loop(live, batches, writer_task, flush_interval))]
+        # Счетчики в CSV и Parquet не обновляются, поэтому запрашивать их нет смысла
+        if writer.updates_counters:
+            tasks.append(asyncio.create_task(_sweep_loop(client, channels, checkpoints, scheduler, writer,
+                                                         batches, sweep_interval, SWEEP_PAUSE)))
+        waiters = tasks + [asyncio.create_task(stop.wait() if stop is not None
+                                               else client.run_until_disconnected())]
+        try:
+            done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in waiters:
+                task.cancel()
+        for task in done:
+            if not task.cancelled():
+                task.result()
+    finally:
+        for callback, event in handlers:
+            client.remove_event_handler(callback, event)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            if not writer_task.done():
+                await live.flush(batches)
+                await batches.put(None)
+            await writer_task
+        except Exception as e:
+            print(f"\nОшибка при сохранении данных в {writer.path}: {str(e)}")
+            checkpoints.rollback()
+        else:
+            checkpoints.commit()
@@ -1,146 +1,526 @@
-from telethon.tl.functions.messages import GetHistoryRequest
-from datetime import datetime, timedelta
-import pandas as pd
-import matplotlib.pyplot as plt
+from telethon.tl.functions.messages import GetHistoryRequest, GetMessagesViewsRequest
+from datetime import date, datetime, timedelta
 import asyncio
 from asyncio import iscoroutine
-import pytz
 import os
+import time
+from collections import deque
+from functools import partial
+from scheduler import RequestScheduler
+from writers import make_writer, load_stats, VISUALIZATION_COLUMNS, TIMEZONE
+from store import MEDIA_COLUMNS
+from matcher import UniversityMatcher
+from media import media_type, file_size, count_reactions, count_replies, media_document
 
-async def process_channel(client, channel):
-    """Обработка одного канала/группы"""
+# Максимальное число id в одном запросе счетчиков
+COUNTERS_BATCH_SIZE = 100
+
+async def refresh_counters(client, channel, checkpoints, scheduler):
+    """Обновление счетчиков недавних сообщений без повторной загрузки текста"""
+    ids = checkpoints.get_refresh_ids(channel.id)
+    for start in range(0, len(ids), COUNTERS_BATCH_SIZE):
+        batch = ids[start:start + COUNTERS_BATCH_SIZE]
+        result = await scheduler.request(
+            client, channel,
+            lambda peer: GetMessagesViewsRequest(peer=peer, id=batch, increment=False))
+        for message_id, counters in zip(batch, result.views):
+            checkpoints.update_counters(channel.id, message_id,
+                                        counters.views or 0, counters.forwards or 0)
+    return len(ids)
+
+# Количество строк в одной пачке, передаваемой на запись
+WRITE_BATCH_SIZE = 500
+
+class MessageRecord:
+    """Компактная запись сообщения: только поля, нужные для анализа
+
+    Сообщения Telethon преобразуются в такие записи сразу после получения,
+    чтобы тяжелые объекты не задерживались в памяти. Из вложения
+    сохраняются только метаданные и, если файл можно загрузить и он
+    нужен для загрузки в кэш (keep_media), ссылка на него (media).
+    """
+    __slots__ = ('id', 'date', 'views', 'forwards', 'text', 'media_type', 'file_size',
+                 'reactions', 'replies', 'media')
+
+    def __init__(self, id, date, views, forwards, text, media_type=None, file_size=None,
+                 reactions=0, replies=0, media=None):
+        self.id = id
+        self.date = date
+        self.views = views
+        self.forwards = forwards
+        self.text = text
+        self.media_type = media_type
+        self.file_size = file_size
+        self.reactions = reactions
+        self.replies = replies
+        self.media = media
+
+    @classmethod
+    def from_message(cls, message, keep_media=False):
+        media = getattr(message, 'media', None)
+        return cls(message.id, message.date, message.views or 0,
+                   message.forwards or 0, message.text, media_type(media), file_size(media),
+                   count_reactions(message), count_replies(message),
+                   media if keep_media and media_document(media) is not None else None)
+
+# Колонки строк сообщений в порядке записи (см. message_row)
+MESSAGE_COLUMNS = ['channel_id', 'message_id', 'university', 'publication_date', 'message',
+                   'views', 'forwards']
+
+def row_columns(media=False):
+    """Колонки строк, которые возвращает message_row"""
+    return MESSAGE_COLUMNS + MEDIA_COLUMNS if media else MESSAGE_COLUMNS
+
+def message_row(channel, record, tz, media=False):
+    """Строка для записи: сообщение канала со временем публикации в зоне tz
+
+    id канала и сообщения позволяют объединять данные разных запусков без повторов.
+    С media=True добавляются метаданные вложения, реакции и ответы (store.MEDIA_COLUMNS).
+    """
+    row = {
+        'channel_id': channel.id,
+        'message_id': record.id,
+        'university': channel.title,
+        'publication_date': record.date.astimezone(tz),
+        'message': record.text,
+        'views': record.views,
+        'forwards': record.forwards
+    }
+    if media:
+        row.update({
+            'media_type': record.media_type,
+            'file_size': record.file_size,
+            'reactions': record.reactions,
+            'replies': record.replies,
+            'media_file': None
+        })
+    return row
+
+# Сколько id сообщений входит в один срез истории канала
+SLICE_SIZE = 2000
+# Сколько срезов одного канала загружаются одновременно
+SLICE_CONCURRENCY = 4
+# Сколько раз повторяется загрузка среза после ошибки и пауза перед повтором, в секундах
+SLICE_RETRIES = 3
+SLICE_RETRY_DELAY = 1.0
+
+def split_id_range(lower, upper, size=None):
+    """Срезы id сообщений (нижний, верхний] от новых к старым"""
+    size = size or SLICE_SIZE
+    slices = []
+    while upper > lower:
+        slices.append((max(lower, upper - size), upper))
+        upper -= size
+    return slices
+
+async def fetch_slice(client, channel, scheduler, lower, upper, keep_media=False):
+    """Сообщения канала с id в (lower, upper] от новых к старым
+
+    Срез загружается целиком, поэтому после ошибки он повторяется
+    отдельно от остальных без повторов в результате.
+    """
+    for attempt in range(SLICE_RETRIES + 1):
+        try:
+            return [MessageRecord.from_message(message, keep_media) async for message in
+                    scheduler.iter_messages(client, channel, min_id=lower, max_id=upper + 1, wait_time=0)]
+        except Exception as e:
+            if attempt == SLICE_RETRIES:
+                raise
+            print(f"Ошибка при загрузке сообщений {lower + 1}-{upper} канала {channel.title}: "
+                  f"{str(e)}, повтор через {SLICE_RETRY_DELAY * 2 ** attempt:.0f} с")
+            await asyncio.sleep(SLICE_RETRY_DELAY * 2 ** attempt)
+
+async def iter_sliced_records(client, channel, scheduler, lower, upper, keep_media=False):
+    """Сообщения канала с id в (lower, upper], загружаемые срезами параллельно
+
+    Одновременно загружается не больше SLICE_CONCURRENCY срезов, а
+    сообщения выдаются по порядку от новых к старым, поэтому в памяти
+    держится ограниченное число срезов. Темп запросов задает общий
+    планировщик.
+    """
+    pending = deque()
+    try:
+        for bounds in split_id_range(lower, upper):
+            pending.append(asyncio.create_task(fetch_slice(client, channel, scheduler, *bounds,
+                                                           keep_media=keep_media)))
+            if len(pending) >= SLICE_CONCURRENCY:
+                for record in await pending.popleft():
+                    yield record
+        while pending:
+            for record in await pending.popleft():
+                yield record
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def _iter_channel_records(client, channel, scheduler, messages, lower, start=None,
+                                keep_media=False):
+    """Сообщения канала от новых к старым
+
+    По первому сообщению потока messages определяется размер истории:
+    если в ней больше SLICE_SIZE id, поток закрывается и история
+    загружается срезами параллельно, иначе поток читается как есть.
+    Срезы ограничиваются снизу последним сообщением до начала периода start.
+    С keep_media в записях сохраняются вложения для загрузки файлов.
+    """
+    first = None
+    async for message in messages:
+        first = MessageRecord.from_message(message, keep_media)
+        break
+    if first is None:
+        return
+    if first.id - lower > SLICE_SIZE and start is not None:
+        async for message in scheduler.iter_messages(client, channel, offset_date=start, limit=1,
+                                                     wait_time=0):
+            lower = max(lower, message.id)
+    if first.id - lower <= SLICE_SIZE:
+        yield first
+        async for message in messages:
+            yield MessageRecord.from_message(message, keep_media)
+        return
+    if hasattr(messages, 'aclose'):
+        await messages.aclose()
+    print(f"История канала {channel.title} загружается срезами по {SLICE_SIZE} сообщений")
+    async for record in iter_sliced_records(client, channel, scheduler, lower, first.id, keep_media):
+        yield record
+
+# Глубина сбора по умолчанию, в днях
+DEFAULT_LOOKBACK_DAYS = 30
+
+def resolve_date_range(start_date=None, end_date=None, lookback_days=DEFAULT_LOOKBACK_DAYS):
+    """Границы периода сбора [начало, конец) с часовым поясом
+
+    start_date и end_date - datetime, date или строка YYYY-MM-DD (дата
+    end_date входит в период целиком). Значения без часового пояса
+    считаются московскими. Без start_date период начинается за
+    lookback_days дней до конца, без end_date заканчивается сейчас.
+    """
+    import pytz
+    tz = pytz.timezone(TIMEZONE)
+    
+    def to_datetime(value, end=False):
+        if isinstance(value, str):
+            value = date.fromisoformat(value)
+        if not isinstance(value, datetime):
+            value = datetime.combine(value + timedelta(days=1) if end else value, datetime.min.time())
+        return tz.localize(value) if value.tzinfo is None else value
+    
+    end = to_datetime(end_date, end=True) if end_date is not None else datetime.now(tz)
+    start = to_datetime(start_date) if start_date is not None else end - timedelta(days=lookback_days)
+    if start >= end:
+        raise ValueError("Начало периода сбора должно быть раньше его конца")
+    return start, end
+
+async def iter_channel_batches(client, channel, checkpoints=None, scheduler=None,
+                               batch_size=WRITE_BATCH_SIZE, metrics=None, date_range=None, media=None,
+                               refresh=True):
+    """Загрузка сообщений канала пачками по batch_size строк
+
+    Загружаются сообщения периода date_range (пара начало, конец; по
+    умолчанию последние DEFAULT_LOOKBACK_DAYS дней): от новых к старым
+    начиная с конца периода (с самых новых, если конец None), пока не
+    будет пройдено его начало.
+    Если передан media (MediaCollector), сохраняются и сообщения без
+    текста с вложениями, к строкам добавляются метаданные, а файлы
+    вложений пачки загружаются в кэш перед ее выдачей.
+    Если передано хранилище контрольных точек, загружаются только сообщения
+    новее сохраненного id, а у недавних сообщений обновляются счетчики
+    (если refresh: обновление нужно только там, где его можно записать).
+    Новая контрольная точка ставится после выдачи последней пачки.
+    Все запросы идут через планировщик, общий для всех каналов.
+    В metrics учитываются сообщения, строки и байты текста канала, а время
+    загрузки - в этапе history_workers (сумма по всем воркерам, поэтому
+    при параллельной загрузке она больше реально прошедшего времени).
+    Длинная история загружается срезами параллельно (см. _iter_channel_records).
+    """
+    if scheduler is None:
+        scheduler = RequestScheduler()
+    print(f"\nОбработка {channel.title}...")
+    started = time.perf_counter()
+    
+    # Устанавливаем московскую временную зону
+    import pytz
+    moscow_tz = pytz.timezone(TIMEZONE)
+    start, end = date_range or resolve_date_range()
+    
+    last_message_id = None
+    if checkpoints is not None:
+        last_message_id = checkpoints.get_last_message_id(channel.id)
+        if refresh:
+            refreshed = await refresh_counters(client, channel, checkpoints, scheduler)
+            if refreshed:
+                print(f"Обновлены счетчики {refreshed} сообщений")
+    
+    # Пачки по 100 сообщений (максимум API) запрашиваются без пауз Telethon,
+    # темп запросов задает планировщик. offset_date отдает сообщения старше
+    # конца периода, начиная с самых новых
+    if last_message_id is None:
+        messages = scheduler.iter_messages(client, channel, offset_date=end, wait_time=0)
+    else:
+        # Получаем только сообщения, появившиеся после прошлого запуска
+        messages = scheduler.iter_messages(client, channel, offset_date=end, min_id=last_message_id,
+                                           wait_time=0)
+    
+    batch = []
+    records_batch = []
+    found = 0
+    newest_id = last_message_id
+    # Вложения Telethon держатся в записях, только если их файлы загружаются в кэш
+    keep_media = media is not None and media.cache is not None
+    records = _iter_channel_records(client, channel, scheduler, messages, last_message_id or 0, start,
+                                    keep_media)
+    async for record in records:
+        message_date = record.date if record.date.tzinfo is not None else record.date.astimezone()
+        if message_date < start:
+            # Дальше только более старые сообщения: загрузка останавливается
+            await records.aclose()
+            break
+        if metrics is not None:
+            metrics.increment('messages', channel=channel.title)
+        if checkpoints is not None:
+            newest_id = max(newest_id or 0, record.id)
+        # Пропускаем сообщения без текста, а при сборе медиа - и без вложений
+        if record.text or (media is not None and record.media_type is not None):
+            if metrics is not None:
+                metrics.increment('rows', channel=channel.title)
+                if record.text:
+                    metrics.increment('bytes', len(record.text.encode('utf-8')), channel=channel.title)
+            # Время публикации конвертируется в московское
+            batch.append(message_row(channel, record, moscow_tz, media is not None))
+            if media is not None:
+                records_batch.append((channel, batch[-1], record))
+            if checkpoints is not None:
+                checkpoints.track_counters(channel.id, record.id, record.date,
+                                           record.views, record.forwards)
+            if len(batch) >= batch_size:
+                found += len(batch)
+                if media is not None:
+                    await media.attach(client, scheduler, records_batch)
+                    records_batch = []
+                if metrics is not None:
+                    metrics.add_stage_time('history_workers', time.perf_counter() - started)
+                yield batch
+                started = time.perf_counter()
+                batch = []
+    
+    if metrics is not None:
+        metrics.add_stage_time('history_workers', time.perf_counter() - started)
+    if batch:
+        found += len(batch)
+        if media is not None:
+            await media.attach(client, scheduler, records_batch)
+        yield batch
+    
+    if checkpoints is not None and newest_id is not None:
+        checkpoints.set_last_message_id(channel.id, newest_id)
+    
+    print(f"Найдено {found} сообщений")
+
+async def process_channel(client, channel, checkpoints=None, scheduler=None, date_range=None,
+                          media=None):
+    """Обработка одного канала/группы с накоплением сообщений в списке"""
     try:
-        print(f"\nОбработка {channel.title}...")
         stats = []
-        
-        # Устанавливаем московскую временную зону
-        moscow_tz = pytz.timezone('Europe/Moscow')
-        current_time = datetime.now(moscow_tz)
-        offset_date = current_time - timedelta(days=30)
-        
-        # Получаем сообщения за последние 30 дней
-        async for message in client.iter_messages(channel, offset_date=offset_date):
-            if message.text:  # Пропускаем сообщения без текста
-                # Конвертируем время в московское
-                message_time = message.date.astimezone(moscow_tz)
-                stats.append({
-                    'university': channel.title,
-                    'publication_date': message_time,
-                    'message': message.text,
-                    'views': message.views or 0,
-                    'forwards': message.forwards or 0
-                })
-        
-        print(f"Найдено {len(stats)} сообщений")
+        async for batch in iter_channel_batches(client, channel, checkpoints, scheduler,
+                                                date_range=date_range, media=media):
+            stats.extend(batch)
         return stats
     except Exception as e:
         print(f"Ошибка при обработке канала {channel.title}: {str(e)}")
         return []
 
-async def collect_telegram_data(client):
-    """Сбор данных из Telegram"""
+# Количество каналов, обрабатываемых одновременно
+MAX_CONCURRENT_CHANNELS = 5
+
+async def _channel_worker(client, queue, batches, checkpoints=None, scheduler=None, metrics=None,
+                          writer=None, date_range=None, media=None):
+    """Воркер пула: передает сообщения каналов из очереди на запись до получения None
+
+    Если передан writer, после сообщений канала в записанные данные
+    переносятся обновленные счетчики из контрольных точек.
+    """
+    while True:
+        channel = await queue.get()
+        try:
+            if channel is None:
+                return
+            # Ошибка одного канала не должна останавливать остальные
+            try:
+                # Счетчики обновляются запросами, только если писатель может перенести их в данные
+                async for batch in iter_channel_batches(client, channel, checkpoints, scheduler,
+                                                        metrics=metrics, date_range=date_range,
+                                                        media=media,
+                                                        refresh=writer is not None and writer.updates_counters):
+                    await batches.put(batch)
+                    if metrics is not None:
+                        metrics.observe_queue('batches', batches.qsize())
+                if checkpoints is not None:
+                    if writer is not None:
+                        await batches.put(partial(writer.sync_counters, checkpoints, channel.id))
+                    # Контрольная точка сохраняется только после записи всех пачек канала
+                    await batches.put(checkpoints.commit)
+            except Exception as e:
+                print(f"Ошибка при обработке канала {channel.title}: {str(e)}")
+                if metrics is not None:
+                    metrics.increment('channel_errors', channel=channel.title)
+            if metrics is not None:
+                metrics.increment('channels_done')
+        finally:
+            queue.task_done()
+
+async def iter_university_dialogs(client, scheduler, matcher):
+    """Каналы и группы университетов среди диалогов аккаунта"""
+    # Поиск каналов и групп (мигрировавшие группы пропускаются на стороне API)
+    async for dialog in scheduler.iter_dialogs(client, ignore_migrated=True):
+        # Личные переписки не бывают каналами университетов
+        if getattr(dialog, 'is_user', False):
+            continue
+        dialog_title = dialog.title if hasattr(dialog, 'title') else dialog.name
+        
+        # Проверяем, относится ли канал к одному из университетов
+        if matcher.classify(dialog_title) is not None:
+            print(f"Найден канал/группа: {dialog_title}")
+            yield dialog
+
+async def collect_telegram_data(client, max_concurrency=MAX_CONCURRENT_CHANNELS, checkpoints=None,
+                                scheduler=None, output_format='csv', output_path=None, columns=None,
+                                matcher=None, metrics=None, start_date=None, end_date=None,
+                                lookback_days=DEFAULT_LOOKBACK_DAYS, media=None, daily_paths=None):
+    """Сбор данных из Telegram
+
+    Найденные каналы обрабатываются пулом из max_concurrency воркеров,
+    сообщения пачками записываются по мере загрузки в CSV, в набор
+    данных Parquet с разбиением по университету и дате или в хранилище
+    SQLite без повторов (output_format).
+    С хранилищем контрольных точек сбор инкрементальный: новые сообщения
+    дописываются к существующему файлу, а контрольная точка канала
+    сохраняется после записи его сообщений.
+    Все воркеры используют общий планировщик запросов, а каналы
+    отбираются классификатором matcher (по умолчанию из universities.json).
+    Если передан metrics, в нем собираются время этапов и счетчики запуска.
+    Собираются сообщения с start_date по end_date, по умолчанию за
+    последние lookback_days дней (см. resolve_date_range).
+    С media (MediaCollector) собираются метаданные вложений и, если
+    задан кэш, загружаются их файлы.
+    Если заданы daily_paths ({уровень: файл}, см.
+    aggregation.DAILY_AGGREGATES_PATHS), в них обновляются дневные агрегаты
+    по университетам и каналам: пересчитываются только дни с новыми
+    сообщениями.
+    Возвращает содержимое файла (только колонки columns, если заданы)
+    или None, если новых сообщений нет.
+    """
     try:
-        # Словарь с альтернативными названиями университетов
-        universities = {
-            'МГУ': [
-                'мгу',
-                'московский государственный университет',
-                'мгу им. ломоносова',
-                'московский университет',
-                'msu',
-                'lomonosov moscow state university'
-            ],
-            'СПбГУ': [
-                'спбгу',
-                'санкт-петербургский государственный университет',
-                'санкт-петербургский университет',
-                'спб университет',
-                'spbu',
-                'saint petersburg state university'
-            ]
-        }
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency должен быть положительным числом")
+        date_range = resolve_date_range(start_date, end_date, lookback_days)
+        print(f"Период сбора: с {date_range[0].strftime('%Y-%m-%d %H:%M')} "
+              f"по {date_range[1].strftime('%Y-%m-%d %H:%M')}")
+
+        # Университеты и их альтернативные названия загружаются из universities.json
+        if matcher is None:
+            matcher = UniversityMatcher.from_file()
+        
+        if scheduler is None:
+            scheduler = RequestScheduler()
+        if metrics is not None:
+            scheduler.attach_metrics(metrics)
         
         print("\nНачинаем поиск каналов и групп...")
-        stats = []
+        writer = make_writer(output_format, output_path, append=checkpoints is not None,
+                             metrics=metrics)
+        # Несовпадение колонок обнаруживается до загрузки сообщений и сдвига контрольных точек
+        writer.check_columns(row_columns(media is not None))
+        batches = asyncio.Queue(maxsize=max_concurrency * 2)
+        writer_task = asyncio.create_task(writer.run(batches))
+        queue = asyncio.Queue(maxsize=max_concurrency * 2)
+        # Этап history - реальное время загрузки истории всеми воркерами (вместе с обходом диалогов)
+        history_started = time.perf_counter()
+        workers = [
+            asyncio.create_task(_channel_worker(client, queue, batches, checkpoints, scheduler, metrics,
+                                                writer, date_range, media))
+            for _ in range(max_concurrency)
+        ]
         
-        # Поиск каналов и групп
-        async for dialog in client.iter_dialogs():
-            dialog_title = dialog.title.lower() if hasattr(dialog, 'title') else dialog.name.lower()
+        try:
+            dialogs_started = time.perf_counter()
+            async for dialog in iter_university_dialogs(client, scheduler, matcher):
+                await queue.put(dialog)
+                if metrics is not None:
+                    metrics.increment('channels_found')
+                    metrics.observe_queue('channels', queue.qsize())
+            if metrics is not None:
+                # Включает ожидание свободных воркеров, если каналов больше, чем мест в очереди
+                metrics.add_stage_time('dialogs', time.perf_counter() - dialogs_started)
+            
+            # Сигнал завершения для каждого воркера
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            if metrics is not None:
+                metrics.add_stage_time('history', time.perf_counter() - history_started)
+            await batches.put(None)
             
-            # Проверяем, относится ли канал к одному из университетов
-            for uni, keywords in universities.items():
-                if any(keyword in dialog_title for keyword in keywords):
-                    print(f"Найден канал/группа: {dialog.title if hasattr(dialog, 'title') else dialog.name}")
-                    channel_stats = await process_channel(client, dialog)
-                    stats.extend(channel_stats)
-                    break  # Если нашли совпадение, переходим к следующему каналу
-        
-        # Создание DataFrame
-        if stats:
-            df = pd.DataFrame(stats)
             try:
-                df.to_csv('telegram_stats.csv', index=False)
-                print("\nДанные успешно сохранены в telegram_stats.csv")
+                await writer_task
             except PermissionError:
-                print("\nОшибка: Невозможно сохранить файл telegram_stats.csv. Возможно, он открыт в другой программе.")
+                print(f"\nОшибка: Невозможно сохранить данные в {writer.path}. Возможно, файл открыт в другой программе.")
+                if checkpoints is not None:
+                    checkpoints.rollback()
                 return None
             except Exception as e:
-                print(f"\nОшибка при сохранении данных в CSV: {str(e)}")
+                print(f"\nОшибка при сохранении данных в {writer.path}: {str(e)}")
+                if checkpoints is not None:
+                    checkpoints.rollback()
                 return None
-            return df
+        finally:
+            for task in workers + [writer_task]:
+                task.cancel()
+        
+        if checkpoints is not None:
+            checkpoints.commit()
+        
+        if writer.rows_written and daily_paths is not None:
+            update_daily_aggregates(writer, daily_paths, matcher)
+        
+        if writer.rows_written:
+            print(f"\nДанные успешно сохранены в {writer.path}")
+            if metrics is None:
+                return load_stats(writer.path, columns=columns)
+            with metrics.stage('load'):
+                return load_stats(writer.path, columns=columns)
         else:
             print("\nНе найдено сообщений для анализа")
             return None
     except Exception as e:
+        if checkpoints is not None:
+            checkpoints.rollback()
         print(f"Ошибка при сборе данных: {str(e)}")
         return None
 
-def create_visualization(df):
-    """Создание визуализации данных"""
-    if df is None or df.empty:
-        print("Нет данных для построения графика")
-        return
-    
+def update_daily_aggregates(writer, daily_paths, matcher=None):
+    """Пересчитывает дневные агрегаты за дни, в которые записаны новые сообщения
+
+    Для этих дней загружаются все собранные сообщения (в том числе прошлых
+    запусков), поэтому их агрегаты заменяются полными суммами. Если данные
+    перезаписаны или какого-то файла агрегатов нет, агрегаты строятся
+    заново по всем собранным сообщениям. После ошибки файлы агрегатов
+    удаляются, чтобы не остались устаревшими: следующий сбор построит их заново.
+    """
+    from aggregation import update_daily_levels
     try:
-        # Построение графика публикаций по дням
-        df['date'] = pd.to_datetime(df['publication_date']).dt.date
-        daily_posts = df.groupby(['university', 'date']).size().unstack(level=0)
-        
-        plt.figure(figsize=(15, 8))
-        daily_posts.plot(kind='line', marker='o', linewidth=2, markersize=5)
-        plt.title('Количество публикаций по дням', fontsize=14, pad=20)
-        plt.xlabel('Дата', fontsize=12)
-        plt.ylabel('Количество публикаций', fontsize=12)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.legend(title='Университет', fontsize=10)
-        
-        # Настройка формата дат на оси X
-        plt.gca().xaxis.set_major_formatter(plt.matplotlib.dates.DateFormatter('%d.%m.%Y'))
-        plt.gcf().autofmt_xdate()  # Автоматический поворот дат для лучшей читаемости
-        
-        plt.tight_layout()  # Автоматическая настройка отступов
-        
-        try:
-            plt.savefig('daily_posts.png', dpi=300, bbox_inches='tight')
-            print("\nГрафик сохранен в daily_posts.png")
-        except PermissionError:
-            print("\nОшибка: Невозможно сохранить файл daily_posts.png. Возможно, он открыт в другой программе.")
-        except Exception as e:
-            print(f"\nОшибка при сохранении графика: {str(e)}")
-        
-        # Вывод общей статистики
-        try:
-            print("\nОбщая статистика:\n"
-                  f"Всего публикаций: {len(df)}\n"
-                  f"Количество уникальных каналов/групп: {df['university'].nunique()}\n"
-                  f"Среднее количество просмотров: {df['views'].mean():.2f}\n"
-                  f"Среднее количество репостов: {df['forwards'].mean():.2f}")
-        except Exception as e:
-            print(f"\nОшибка при подсчете статистики: {str(e)}")
-            
+        rebuild = not writer.append or not all(os.path.exists(path) for path in daily_paths.values())
+        if rebuild:
+            rows = load_stats(writer.path, columns=VISUALIZATION_COLUMNS)
+            update_daily_levels(rows, daily_paths, matcher=matcher, replace=True)
+            print(f"Дневные агрегаты построены заново в {', '.join(daily_paths.values())}")
+        else:
+            days = sorted(writer.written_days)
+            rows = load_stats(writer.path, columns=VISUALIZATION_COLUMNS,
+                              start_date=days[0], end_date=days[-1])
+            update_daily_levels(rows, daily_paths, matcher=matcher, days=days)
+            print(f"Дневные агрегаты за {len(days)} дн. обновлены в {', '.join(daily_paths.values())}")
     except Exception as e:
-        print(f"\nОшибка при создании визуализации: {str(e)}\n"
-              "Проверьте, что:\n"
-              "1. Данные содержат правильные значения\n"
-              "2. Достаточно свободного места на диске\n"
-              "3. У программы есть права на запись в текущую директорию") 
\ No newline at end of file
+        print(f"Ошибка при обновлении дневных агрегатов: {str(e)}")
+        for path in daily_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
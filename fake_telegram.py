@@ -0,0 +1,228 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from telethon import events
+from telethon.errors import FloodWaitError
+from telethon.tl.functions.messages import GetMessagesViewsRequest
+from telethon.tl.types import (MessageMediaPhoto, Photo, PhotoSize, MessageReactions,
+                               ReactionCount, ReactionEmoji, MessageReplies)
+
+# Telegram отдает историю и диалоги пачками не больше 100 элементов
+CHUNK_SIZE = 100
+
+
+class FakeDialog:
+    """Диалог локального клиента: канал с синтетической историей"""
+
+    def __init__(self, id, title, is_user=False):
+        self.id = id
+        self.title = title
+        self.name = title
+        self.is_user = is_user
+        self.entity = self
+
+
+class FakeMessage:
+    """Сообщение синтетической истории"""
+    __slots__ = ('id', 'date', 'text', 'message', 'views', 'forwards', 'media', 'reactions', 'replies')
+
+    def __init__(self, id, date, text, views, forwards, media=None, reactions=None, replies=None):
+        self.id = id
+        self.date = date
+        self.text = text
+        self.message = text
+        self.views = views
+        self.forwards = forwards
+        self.media = media
+        self.reactions = reactions
+        self.replies = replies
+
+
+class FakeMessageViews:
+    __slots__ = ('views', 'forwards', 'replies')
+
+    def __init__(self, views, forwards):
+        self.views = views
+        self.forwards = forwards
+        self.replies = None
+
+
+class FakeMessagesViews:
+    """Ответ на GetMessagesViewsRequest"""
+
+    def __init__(self, views):
+        self.views = views
+
+
+class FakeUpdate:
+    """Событие о новом или отредактированном сообщении"""
+
+    def __init__(self, chat_id, message):
+        self.chat_id = chat_id
+        self.message = message
+
+
+class FakeTelegramClient:
+    """Локальная замена TelegramClient для тестов и замеров производительности
+
+    Отдает channels каналов университетов (и столько же посторонних
+    диалогов) с историей по messages_per_channel сообщений, равномерно
+    распределенных за последние days дней. Сообщения создаются на лету,
+    поэтому история любого размера не занимает память. Каждый запрос
+    (пачка из 100 элементов) задерживается на latency секунд, а каждый
+    flood_every-й запрос завершается FloodWaitError на flood_seconds секунд.
+    Каждое empty_every-е сообщение приходит без текста, а каждое
+    media_every-е - с фото, реакциями и ответами.
+    Новые и отредактированные сообщения передаются подписанным обработчикам
+    методом publish.
+    """
+
+    def __init__(self, channels=10, messages_per_channel=1000, days=60, latency=0.0,
+                 flood_every=None, flood_seconds=0, empty_every=None, media_every=None, now=None):
+        self.messages_per_channel = messages_per_channel
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.empty_every = empty_every
+        self.media_every = media_every
+        self.downloads = 0
+        self.now = now or datetime.now(timezone.utc)
+        self.step = timedelta(days=days) / max(messages_per_channel, 1)
+        self.requests = 0
+        self.flood_waits = 0
+        self.handlers = []
+        self.disconnected = asyncio.Event()
+        universities = ['МГУ', 'СПбГУ']
+        self.dialogs = []
+        for index in range(channels):
+            university = universities[index % len(universities)]
+            self.dialogs.append(FakeDialog(-1000000000000 - index, f"{university} канал {index}"))
+            self.dialogs.append(FakeDialog(index + 1, f"Собеседник {index}", is_user=True))
+
+    async def _request(self):
+        """Имитирует один запрос к API: задержка и, возможно, FloodWait"""
+        self.requests += 1
+        if self.flood_every and self.requests % self.flood_every == 0:
+            self.flood_waits += 1
+            error = FloodWaitError(request=None)
+            error.seconds = self.flood_seconds
+            raise error
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def message_date(self, message_id):
+        """Дата сообщения: id растут вместе с датой, последнее опубликовано сейчас"""
+        return self.now - (self.messages_per_channel - message_id) * self.step
+
+    def make_message(self, channel_id, message_id):
+        text = None
+        if not self.empty_every or message_id % self.empty_every:
+            text = f"Новость {message_id} канала {channel_id} #университет https://example.com/{message_id}"
+        views = (message_id * 37 + abs(channel_id)) % 5000
+        message = FakeMessage(message_id, self.message_date(message_id), text, views, views // 50)
+        if self.media_every and message_id % self.media_every == 0:
+            # Одно и то же фото во всех каналах, как при репостах
+            message.media = MessageMediaPhoto(photo=Photo(
+                id=message_id, access_hash=0, file_reference=b'', date=message.date, dc_id=2,
+                sizes=[PhotoSize('s', 90, 90, 1000), PhotoSize('m', 320, 320, 20000),
+                       PhotoSize('y', 1280, 1280, 200000)]))
+            message.reactions = MessageReactions(results=[ReactionCount(ReactionEmoji('👍'), message_id % 7)])
+            message.replies = MessageReplies(replies=message_id % 5, replies_pts=0)
+        return message
+
+    async def download_media(self, media, file=None, thumb=None):
+        """Загрузка фото: содержимое зависит только от id фото и варианта размера
+
+        Как Telethon, к пути без расширения добавляет .jpg, к пути
+        существующего файла - номер ("<путь> (1).jpg"), а при ошибке во
+        время загрузки оставляет недокачанный файл.
+        """
+        size = thumb.type if thumb is not None else media.photo.sizes[-1].type
+        data = f"фото {media.photo.id} {size}".encode('utf-8')
+        if file is bytes:
+            await self._request()
+            self.downloads += 1
+            return data
+        name, extension = os.path.splitext(file)
+        extension = extension or '.jpg'
+        path, number = name + extension, 0
+        while os.path.exists(path):
+            number += 1
+            path = f'{name} ({number}){extension}'
+        with open(path, 'wb') as output:
+            await self._request()
+            output.write(data)
+        self.downloads += 1
+        return path
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        self.disconnected.set()
+
+    async def run_until_disconnected(self):
+        await self.disconnected.wait()
+
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers = [(c, e) for c, e in self.handlers
+                         if c != callback or (event is not None and e is not event)]
+
+    async def publish(self, channel_id, message_id, text, views=0, forwards=0, edited=False):
+        """Передает обработчикам новое (или отредактированное) сообщение канала"""
+        message = FakeMessage(message_id, datetime.now(timezone.utc), text, views, forwards)
+        update = FakeUpdate(channel_id, message)
+        for callback, event in list(self.handlers):
+            # MessageEdited наследуется от NewMessage, поэтому событие определяется по нему
+            if isinstance(event, events.MessageEdited) != edited:
+                continue
+            await callback(update)
+
+    async def is_user_authorized(self):
+        return True
+
+    async def iter_dialogs(self, limit=None, **kwargs):
+        dialogs = self.dialogs[:limit] if limit is not None else self.dialogs
+        for start in range(0, len(dialogs), CHUNK_SIZE):
+            await self._request()
+            for dialog in dialogs[start:start + CHUNK_SIZE]:
+                yield dialog
+
+    async def iter_messages(self, entity, limit=None, offset_date=None, offset_id=0,
+                            min_id=0, max_id=0, reverse=False, **kwargs):
+        """История канала с семантикой параметров Telethon
+
+        Без reverse сообщения идут от новых к старым и offset_date/offset_id
+        ограничивают их сверху; с reverse - от старых к новым и ограничивают снизу.
+        """
+        ids = range(1, self.messages_per_channel + 1)
+        if reverse:
+            lower = max(min_id, offset_id)
+            ids = [i for i in ids if i > lower and (not max_id or i < max_id)]
+            if offset_date is not None:
+                ids = [i for i in ids if self.message_date(i) >= offset_date]
+        else:
+            upper = min(x for x in (offset_id, max_id, self.messages_per_channel + 1) if x)
+            ids = [i for i in reversed(ids) if min_id < i < upper]
+            if offset_date is not None:
+                ids = [i for i in ids if self.message_date(i) < offset_date]
+        if limit is not None:
+            ids = ids[:limit]
+        for start in range(0, len(ids), CHUNK_SIZE):
+            await self._request()
+            for message_id in ids[start:start + CHUNK_SIZE]:
+                yield self.make_message(entity.id, message_id)
+
+    async def __call__(self, request):
+        await self._request()
+        if isinstance(request, GetMessagesViewsRequest):
+            channel_id = request.peer.id
+            views = []
+            for message_id in request.id:
+                message = self.make_message(channel_id, message_id)
+                views.append(FakeMessageViews(message.views, message.forwards))
+            return FakeMessagesViews(views)
+        raise NotImplementedError(f"Запрос {type(request).__name__} не поддерживается")
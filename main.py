@@ -1,36 +1,246 @@
+import argparse
 import asyncio
-from auth import authenticate_client
-from data_collector import collect_telegram_data, create_visualization
+import os
+import sys
+from contextlib import nullcontext
 
-async def main():
+# Тяжелые зависимости (pandas, matplotlib, telethon) импортируются внутри команд,
+# чтобы --help и короткие запуски по расписанию не тратили время на их загрузку
+
+def print_error_help(e):
+    print(f"\nОшибка: {str(e)}\n"
+          "\nУбедитесь, что:\n"
+          "1. Вы правильно ввели API_ID (должен быть числом)\n"
+          "2. Вы правильно ввели API_HASH\n"
+          "3. Вы правильно ввели номер телефона в формате +7XXXXXXXXXX\n"
+          "4. У вас есть доступ к интернету\n"
+          "5. Вы зарегистрировали приложение на https://my.telegram.org\n"
+          "\nЕсли проблема сохраняется, попробуйте:\n"
+          "1. Подождать несколько минут и запустить скрипт снова\n"
+          "2. Проверить подключение к интернету\n"
+          "3. Убедиться, что Telegram работает на вашем устройстве")
+
+def default_data_path():
+    """Путь к собранным данным из OUTPUT_PATH или по умолчанию для OUTPUT_FORMAT"""
+    from dotenv import load_dotenv
+    from writers import STATS_PATH, PARQUET_PATH, STORE_PATH
+    load_dotenv()
+    if os.getenv('OUTPUT_PATH'):
+        return os.getenv('OUTPUT_PATH')
+    return {'parquet': PARQUET_PATH, 'sqlite': STORE_PATH}.get(os.getenv('OUTPUT_FORMAT', 'csv'), STATS_PATH)
+
+async def auth_command(args):
+    """Авторизация всех сессий из SESSIONS без сбора данных"""
+    from auth import authenticate_clients, get_session_names
+    try:
+        clients = await authenticate_clients(get_session_names())
+    except Exception as e:
+        print_error_help(e)
+        return 1
+    for name, client in clients:
+        print(f"Сессия {name} авторизована")
+        await client.disconnect()
+    return 0
+
+async def crawl_command(args):
+    """Сбор данных, построение отчета и анализ текстов"""
+    from auth import authenticate_clients, get_session_names
+    from checkpoints import CheckpointStore
+    from sharding import Account, AccountPool
+    from metrics import Metrics
+    from matcher import UniversityMatcher
+    from data_collector import collect_telegram_data, VISUALIZATION_COLUMNS, DEFAULT_LOOKBACK_DAYS
+    from aggregation import DAILY_AGGREGATES_PATHS, load_daily_levels
+    
+    # Метрики запуска сохраняются в METRICS_PATH (.json или .prom для Prometheus),
+    # PROGRESS=1 включает строку прогресса
+    metrics = Metrics()
     try:
-        # Аутентификация
-        client = await authenticate_client()
+        # Аутентификация всех аккаунтов из SESSIONS или только аккаунта SHARD,
+        # если каждый аккаунт запускается в отдельном процессе
+        session_names = get_session_names()
+        # Период сбора: --start/--end или START_DATE/END_DATE, иначе последние
+        # --days или LOOKBACK_DAYS дней
+        start_date = getattr(args, 'start', None) or os.getenv('START_DATE') or None
+        end_date = getattr(args, 'end', None) or os.getenv('END_DATE') or None
+        lookback_days = getattr(args, 'days', None)
+        if lookback_days is None:
+            lookback_days = int(os.getenv('LOOKBACK_DAYS') or DEFAULT_LOOKBACK_DAYS)
+        if lookback_days < 1:
+            raise ValueError("LOOKBACK_DAYS должен быть положительным числом")
+        
+        shard = os.getenv('SHARD')
+        if shard and shard not in session_names:
+            raise ValueError(f"Сессия {shard} не указана в SESSIONS")
+        # Список университетов читается в отдельном потоке одновременно с подключением
+        with metrics.stage('connect'):
+            clients, matcher = await asyncio.gather(
+                authenticate_clients([shard] if shard else session_names, session_names),
+                asyncio.to_thread(UniversityMatcher.from_file))
+        client = clients[0][1]
+        scheduler = None
+        if len(session_names) > 1:
+            scheduler = AccountPool([Account(name, c) for name, c in clients],
+                                    shard_names=session_names)
+        
+        # Инкрементальный сбор включается переменной INCREMENTAL=1 в .env,
+        # постоянный режим (DAEMON=1) всегда инкрементальный
+        daemon = os.getenv('DAEMON') == '1'
+        # Постоянный режим собирает сообщения до остановки, конец периода в нем не задается
+        if daemon and end_date is not None:
+            raise ValueError("END_DATE (--end) не поддерживается в постоянном режиме (DAEMON=1)")
+        checkpoints = CheckpointStore() if daemon or os.getenv('INCREMENTAL') == '1' else None
+        
+        # MEDIA=1 добавляет метаданные вложений, реакции и ответы, а MEDIA_DOWNLOAD
+        # (thumb или file) загружает миниатюры или файлы в кэш MEDIA_CACHE_DIR
+        # размером не больше MEDIA_CACHE_MB мегабайт
+        media = None
+        if os.getenv('MEDIA') == '1':
+            from media import MediaCollector, MediaCache, MEDIA_CACHE_DIR, MEDIA_CACHE_MB
+            download = os.getenv('MEDIA_DOWNLOAD') or None
+            if download not in (None, 'thumb', 'file'):
+                raise ValueError(f"Неизвестный режим загрузки медиа: {download}. Доступны: thumb, file")
+            cache = None
+            if download:
+                cache = MediaCache(os.getenv('MEDIA_CACHE_DIR') or MEDIA_CACHE_DIR,
+                                   int(os.getenv('MEDIA_CACHE_MB') or MEDIA_CACHE_MB) * 1024 * 1024)
+            media = MediaCollector(cache, thumbnails=download != 'file', metrics=metrics)
+        
+        progress = None
+        if os.getenv('PROGRESS') == '1':
+            progress = asyncio.create_task(metrics.report_progress())
         
         try:
+            if daemon:
+                from daemon import run_daemon
+                # Новые сообщения записываются по мере публикации до остановки процесса
+                await run_daemon(client, checkpoints, scheduler=scheduler,
+                                 output_format=os.getenv('OUTPUT_FORMAT', 'csv'),
+                                 output_path=os.getenv('OUTPUT_PATH') or None,
+                                 matcher=matcher, metrics=metrics, media=media,
+                                 start_date=start_date, lookback_days=lookback_days)
+                return 0
+            
             # Сбор данных
-            df = await collect_telegram_data(client)
+            # Текст сообщений для графиков не нужен, поэтому загружаем его обратно
+            # только для анализа текстов (TEXT_ANALYTICS=1) вместе с id канала для поиска дубликатов
+            text_analytics = os.getenv('TEXT_ANALYTICS') == '1'
+            columns = VISUALIZATION_COLUMNS + ['channel_id', 'message'] if text_analytics else VISUALIZATION_COLUMNS
+            # Формат вывода задается переменной OUTPUT_FORMAT (csv, parquet или sqlite)
+            # Процессам разных аккаунтов нужны разные файлы CSV (OUTPUT_PATH) или Parquet
+            df = await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler,
+                                             output_format=os.getenv('OUTPUT_FORMAT', 'csv'),
+                                             output_path=os.getenv('OUTPUT_PATH') or None,
+                                             columns=columns, matcher=matcher,
+                                             metrics=metrics, start_date=start_date,
+                                             end_date=end_date, lookback_days=lookback_days,
+                                             media=media, daily_paths=DAILY_AGGREGATES_PATHS)
             
-            # Создание визуализации, если есть данные
+            # Построение графиков отчета в пуле процессов, если есть данные:
+            # графики строятся по только что обновленным дневным агрегатам
             if df is not None:
-                create_visualization(df)
-                
+                daily = await asyncio.to_thread(load_daily_levels, DAILY_AGGREGATES_PATHS)
+                await build_report(df, matcher, text_analytics, metrics, daily)
+            return 0
+            
         finally:
-            # Отключение клиента
-            await client.disconnect()
+            if progress is not None:
+                progress.cancel()
+            # Отключение клиентов
+            for _, c in clients:
+                await c.disconnect()
+            if checkpoints is not None:
+                checkpoints.close()
+            if media is not None:
+                media.close()
+            if os.getenv('METRICS_PATH'):
+                metrics.save(os.getenv('METRICS_PATH'))
+                print(f"Метрики сохранены в {os.getenv('METRICS_PATH')}")
             
     except Exception as e:
-        print(f"\nОшибка: {str(e)}\n"
-              "\nУбедитесь, что:\n"
-              "1. Вы правильно ввели API_ID (должен быть числом)\n"
-              "2. Вы правильно ввели API_HASH\n"
-              "3. Вы правильно ввели номер телефона в формате +7XXXXXXXXXX\n"
-              "4. У вас есть доступ к интернету\n"
-              "5. Вы зарегистрировали приложение на https://my.telegram.org\n"
-              "\nЕсли проблема сохраняется, попробуйте:\n"
-              "1. Подождать несколько минут и запустить скрипт снова\n"
-              "2. Проверить подключение к интернету\n"
-              "3. Убедиться, что Telegram работает на вашем устройстве")
+        print_error_help(e)
+        return 1
+
+async def build_report(df, matcher=None, text_analytics=False, metrics=None, daily=None):
+    """Графики (по дневным агрегатам daily, если они есть), общая статистика и анализ текстов"""
+    from report import generate_report, print_summary
+    with metrics.stage('plot') if metrics is not None else nullcontext():
+        await generate_report(df, matcher=matcher, daily=daily)
+    print_summary(df)
+    if text_analytics:
+        from text_analytics import analyze_messages, save_text_analytics
+        with metrics.stage('text') if metrics is not None else nullcontext():
+            results = await asyncio.to_thread(analyze_messages, df)
+        save_text_analytics(results)
+
+async def report_command(args):
+    """Отчет по уже собранным данным без подключения к Telegram"""
+    from writers import load_stats, VISUALIZATION_COLUMNS
+    columns = VISUALIZATION_COLUMNS + ['channel_id', 'message'] if args.text else VISUALIZATION_COLUMNS
+    try:
+        df = load_stats(args.source or default_data_path(), columns=columns,
+                        start_date=args.start, end_date=args.end)
+    except Exception as e:
+        print(f"Ошибка при загрузке данных: {str(e)}")
+        return 1
+    await build_report(df, text_analytics=args.text)
+    return 0
+
+async def export_command(args):
+    """Выгрузка собранных данных в CSV или Parquet с фильтрами"""
+    from writers import load_stats
+    columns = args.columns.split(',') if args.columns else None
+    universities = args.universities.split(',') if args.universities else None
+    try:
+        df = load_stats(args.source or default_data_path(), columns=columns,
+                        universities=universities, start_date=args.start, end_date=args.end)
+        if args.output.endswith('.parquet'):
+            df.to_parquet(args.output, index=False)
+        else:
+            df.to_csv(args.output, index=False)
+    except Exception as e:
+        print(f"Ошибка при выгрузке данных: {str(e)}")
+        return 1
+    print(f"Выгружено {len(df)} строк в {args.output}")
+    return 0
+
+COMMANDS = {
+    'auth': auth_command,
+    'crawl': crawl_command,
+    'report': report_command,
+    'export': export_command,
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Сбор статистики каналов университетов в Telegram. "
+                    "Без команды выполняется crawl.")
+    commands = parser.add_subparsers(dest='command', metavar='команда')
+    commands.add_parser('auth', help="авторизовать сессии из SESSIONS и сохранить их")
+    crawl = commands.add_parser('crawl', help="собрать данные и построить отчет (настройки в .env)")
+    crawl.add_argument('--days', type=int, help="глубина сбора в днях (по умолчанию LOOKBACK_DAYS или 30)")
+    crawl.add_argument('--start', help="начальная дата сбора YYYY-MM-DD (по умолчанию START_DATE)")
+    crawl.add_argument('--end', help="конечная дата сбора YYYY-MM-DD включительно (по умолчанию END_DATE)")
+    
+    def add_filters(command):
+        command.add_argument('--source', help="собранные данные (по умолчанию из OUTPUT_FORMAT/OUTPUT_PATH)")
+        command.add_argument('--start', help="начальная дата YYYY-MM-DD включительно")
+        command.add_argument('--end', help="конечная дата YYYY-MM-DD включительно")
+    
+    report = commands.add_parser('report', help="построить отчет по собранным данным")
+    add_filters(report)
+    report.add_argument('--text', action='store_true', help="также проанализировать тексты сообщений")
+    
+    export = commands.add_parser('export', help="выгрузить собранные данные")
+    add_filters(export)
+    export.add_argument('output', help="файл выгрузки: .csv или .parquet")
+    export.add_argument('--columns', help="колонки через запятую")
+    export.add_argument('--universities', help="каналы через запятую")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return asyncio.run(COMMANDS[args.command or 'crawl'](args))
 
 if __name__ == '__main__':
-    asyncio.run(main()) 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
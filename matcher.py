@@ -0,0 +1,76 @@
+import json
+import os
+import re
+
+# Файл со списком университетов и их альтернативных названий (рядом с модулем)
+UNIVERSITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'universities.json')
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize(text):
+    """Приводит название к виду для сравнения: нижний регистр, ё -> е, одиночные пробелы"""
+    return _WHITESPACE.sub(' ', text.lower().replace('ё', 'е')).strip()
+
+
+def _trie_pattern(node):
+    """Строит регулярное выражение по префиксному дереву названий
+
+    Общие префиксы выносятся за скобки, поэтому проверка идет по дереву,
+    а не перебором всех альтернатив подряд.
+    """
+    branches = [re.escape(char) + _trie_pattern(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    terminal = '' in node
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    # Жадный необязательный хвост выбирает самое длинное совпадение
+    return pattern + '?' if terminal else pattern
+
+
+class UniversityMatcher:
+    """Классификатор названий каналов по университетам
+
+    Все альтернативные названия один раз компилируются в одно регулярное
+    выражение, и название канала проверяется за один проход. Если в
+    названии встречается несколько университетов, выбирается тот, чье
+    название встречается раньше. При совпадающих названиях у разных
+    университетов приоритет у указанного в конфигурации первым.
+    """
+
+    def __init__(self, universities):
+        if not isinstance(universities, dict):
+            raise ValueError("Список университетов должен быть словарем {университет: [названия]}")
+        self.universities = list(universities)
+        self._aliases = {}
+        for university, keywords in universities.items():
+            if isinstance(keywords, str) or not all(isinstance(k, str) for k in keywords):
+                raise ValueError(f"Названия университета {university} должны быть списком строк")
+            for keyword in keywords:
+                alias = normalize(keyword)
+                if alias:
+                    self._aliases.setdefault(alias, university)
+
+        trie = {}
+        for alias in self._aliases:
+            node = trie
+            for char in alias:
+                node = node.setdefault(char, {})
+            node[''] = True
+        self._pattern = re.compile(_trie_pattern(trie)) if trie else None
+
+    @classmethod
+    def from_file(cls, path=UNIVERSITIES_PATH):
+        """Загружает университеты из JSON-файла"""
+        with open(path, encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def classify(self, title):
+        """Возвращает университет, к которому относится название, или None"""
+        if self._pattern is None or not title:
+            return None
+        match = self._pattern.search(normalize(title))
+        return self._aliases[match.group(0)] if match else None
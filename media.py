@@ -0,0 +1,322 @@
+import asyncio
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from telethon.tl.types import (MessageMediaPhoto, MessageMediaDocument, MessageMediaWebPage,
+                               MessageMediaPoll, MessageMediaGeo, MessageMediaGeoLive,
+                               MessageMediaVenue, MessageMediaContact, Photo, Document,
+                               PhotoSize, PhotoSizeProgressive, PhotoCachedSize,
+                               DocumentAttributeVideo, DocumentAttributeAudio,
+                               DocumentAttributeSticker, DocumentAttributeAnimated)
+
+# Каталог кэша загруженных медиа по умолчанию
+MEDIA_CACHE_DIR = 'media_cache'
+# Предельный размер кэша по умолчанию, в мегабайтах
+MEDIA_CACHE_MB = 500
+# Сколько файлов загружается одновременно
+MEDIA_CONCURRENCY = 4
+# Файлы больше этого размера (в байтах) не загружаются
+MEDIA_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Незавершенные загрузки старше этого времени (в секундах) удаляются при открытии кэша
+MEDIA_TEMP_MAX_AGE = 3600
+# Миниатюрой считается наибольшее изображение со стороной не больше THUMB_SIDE пикселей
+THUMB_SIDE = 320
+
+
+def _size_bytes(size):
+    """Размер файла варианта изображения в байтах"""
+    if isinstance(size, PhotoSize):
+        return size.size
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes) if size.sizes else 0
+    if isinstance(size, PhotoCachedSize):
+        return len(size.bytes)
+    return 0
+
+
+def media_type(media):
+    """Тип вложения сообщения или None, если вложения нет"""
+    if media is None:
+        return None
+    if isinstance(media, MessageMediaPhoto):
+        return 'photo'
+    if isinstance(media, MessageMediaDocument):
+        attributes = media.document.attributes if isinstance(media.document, Document) else []
+        for attribute in attributes:
+            if isinstance(attribute, DocumentAttributeSticker):
+                return 'sticker'
+            if isinstance(attribute, DocumentAttributeAnimated):
+                return 'animation'
+        for attribute in attributes:
+            if isinstance(attribute, DocumentAttributeVideo):
+                return 'round' if attribute.round_message else 'video'
+            if isinstance(attribute, DocumentAttributeAudio):
+                return 'voice' if attribute.voice else 'audio'
+        return 'document'
+    if isinstance(media, MessageMediaWebPage):
+        return 'webpage'
+    if isinstance(media, MessageMediaPoll):
+        return 'poll'
+    if isinstance(media, (MessageMediaGeo, MessageMediaGeoLive, MessageMediaVenue)):
+        return 'geo'
+    if isinstance(media, MessageMediaContact):
+        return 'contact'
+    return 'other'
+
+
+def file_size(media):
+    """Размер файла вложения в байтах (для фото - наибольшего варианта) или None"""
+    if isinstance(media, MessageMediaPhoto) and isinstance(media.photo, Photo):
+        return max((_size_bytes(size) for size in media.photo.sizes), default=None)
+    if isinstance(media, MessageMediaDocument) and isinstance(media.document, Document):
+        return media.document.size
+    return None
+
+
+def count_reactions(message):
+    """Общее число реакций на сообщение"""
+    reactions = getattr(message, 'reactions', None)
+    if reactions is None:
+        return 0
+    return sum(result.count for result in reactions.results)
+
+
+def count_replies(message):
+    """Число ответов (комментариев) к сообщению"""
+    replies = getattr(message, 'replies', None)
+    return replies.replies if replies is not None else 0
+
+
+def media_document(media):
+    """Фото или документ вложения, если его можно загрузить"""
+    if isinstance(media, MessageMediaPhoto) and isinstance(media.photo, Photo):
+        return media.photo
+    if isinstance(media, MessageMediaDocument) and isinstance(media.document, Document):
+        return media.document
+    return None
+
+
+def _thumbnail(file):
+    """Вариант изображения для миниатюры: наибольший со стороной не больше THUMB_SIDE"""
+    sizes = file.sizes if isinstance(file, Photo) else (file.thumbs or [])
+    sizes = [size for size in sizes if isinstance(size, (PhotoSize, PhotoSizeProgressive))]
+    if not sizes:
+        return None
+    small = [size for size in sizes if max(size.w, size.h) <= THUMB_SIDE]
+    if small:
+        return max(small, key=_size_bytes)
+    return min(sizes, key=_size_bytes)
+
+
+class MediaCache:
+    """Кэш загруженных медиа на диске с адресацией по содержимому
+
+    Файл хранится под SHA-256 своего содержимого (root/ab/abcd...),
+    поэтому одинаковые файлы из разных каналов занимают место один раз.
+    Индекс в root/index.sqlite связывает ключи файлов Telegram с хешами
+    содержимого, чтобы уже загруженные файлы не запрашивались повторно,
+    и хранит время последнего обращения. Когда общий размер превышает
+    max_bytes, удаляются файлы, к которым дольше всего не обращались.
+    Загрузки идут в root/tmp, оставшиеся там после сбоев файлы удаляются
+    при открытии кэша.
+    """
+
+    def __init__(self, root=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self._clear_temp()
+        # Файлы добавляются из рабочих потоков, индекс защищен блокировкой
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                digest TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sources (
+                source_key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS blobs_last_access ON blobs (last_access);
+        """)
+        self.connection.commit()
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def temp_path(self):
+        """Путь для загрузки файла до того, как известно его содержимое
+
+        Telethon добавляет к нему расширение, а при повторе загрузки -
+        номер ("<путь> (1).jpg"), поэтому все файлы загрузки начинаются
+        с этого пути (см. discard_temp).
+        """
+        return os.path.join(self.root, 'tmp', uuid.uuid4().hex)
+
+    def discard_temp(self, temp_path):
+        """Удаляет все файлы загрузки по пути temp_path, в том числе недокачанные"""
+        for path in glob.glob(glob.escape(temp_path) + '*'):
+            os.remove(path)
+
+    def _clear_temp(self):
+        """Удаляет файлы, оставшиеся в tmp после прерванных запусков
+
+        Недавние файлы не трогаются: их может загружать другой процесс с тем же кэшем.
+        """
+        cutoff = time.time() - MEDIA_TEMP_MAX_AGE
+        with os.scandir(os.path.join(self.root, 'tmp')) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+
+    def lookup(self, source_key):
+        """Хеш содержимого уже загруженного файла или None"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT digest FROM sources WHERE source_key = ?", (source_key,)).fetchone()
+            if row is None or not os.path.exists(self.path(row[0])):
+                return None
+            self.connection.execute("UPDATE blobs SET last_access = ? WHERE digest = ?",
+                                    (time.time(), row[0]))
+            self.connection.commit()
+            return row[0]
+
+    def add(self, source_key, path):
+        """Переносит загруженный файл path в кэш и возвращает хеш его содержимого"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        size = os.path.getsize(path)
+        target = self.path(digest)
+        with self._lock:
+            if os.path.exists(target):
+                os.remove(path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.move(path, target)
+            self.connection.execute(
+                """INSERT INTO blobs (digest, size, last_access) VALUES (?, ?, ?)
+                   ON CONFLICT(digest) DO UPDATE SET last_access = excluded.last_access""",
+                (digest, size, time.time()))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sources (source_key, digest) VALUES (?, ?)",
+                (source_key, digest))
+            self._evict(keep=digest)
+            self.connection.commit()
+        return digest
+
+    def _evict(self, keep=None):
+        """Удаляет давно не использованные файлы, пока кэш больше max_bytes"""
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute(
+            "SELECT digest, size FROM blobs WHERE digest != ? ORDER BY last_access", (keep or '',)
+        ).fetchall()
+        for digest, size in rows:
+            if total <= self.max_bytes:
+                break
+            if os.path.exists(self.path(digest)):
+                os.remove(self.path(digest))
+            self.connection.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            self.connection.execute("DELETE FROM sources WHERE digest = ?", (digest,))
+            total -= size
+
+    def size(self):
+        """Общий размер файлов в кэше, в байтах"""
+        with self._lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class MediaCollector:
+    """Сбор метаданных вложений и загрузка файлов в кэш
+
+    Без кэша к строкам сообщений только добавляются метаданные
+    (store.MEDIA_COLUMNS). С кэшем загружаются миниатюры (thumbnails=True) или
+    сами файлы не больше max_file_size: одновременно не больше concurrency
+    загрузок, а файлы, уже находящиеся в кэше, повторно не запрашиваются.
+    """
+
+    def __init__(self, cache=None, thumbnails=True, concurrency=MEDIA_CONCURRENCY,
+                 max_file_size=MEDIA_MAX_FILE_SIZE, metrics=None):
+        self.cache = cache
+        self.thumbnails = thumbnails
+        self.max_file_size = max_file_size
+        self.metrics = metrics
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Загрузки одного файла из разных каналов выполняются один раз
+        self._pending = {}
+
+    def _source_key(self, file):
+        kind = 'photo' if isinstance(file, Photo) else 'document'
+        return f"{kind}:{file.id}:{'thumb' if self.thumbnails else 'file'}"
+
+    async def download(self, client, scheduler, channel, record):
+        """Хеш содержимого файла вложения record в кэше или None"""
+        if self.cache is None:
+            return None
+        file = media_document(record.media)
+        if file is None:
+            return None
+        thumb = None
+        if self.thumbnails:
+            thumb = _thumbnail(file)
+            if thumb is None:
+                return None
+        elif (record.file_size or 0) > self.max_file_size:
+            return None
+        key = self._source_key(file)
+        if key not in self._pending:
+            self._pending[key] = asyncio.ensure_future(
+                self._fetch(client, scheduler, channel, record.media, key, thumb))
+        try:
+            return await asyncio.shield(self._pending[key])
+        finally:
+            if self._pending.get(key) is not None and self._pending[key].done():
+                self._pending.pop(key, None)
+
+    async def _fetch(self, client, scheduler, channel, media, key, thumb):
+        digest = await asyncio.to_thread(self.cache.lookup, key)
+        if digest is not None:
+            if self.metrics is not None:
+                self.metrics.increment('media_cache_hits')
+            return digest
+        async with self._semaphore:
+            temp_path = self.cache.temp_path()
+            try:
+                path = await scheduler.download_media(client, channel, media, file=temp_path, thumb=thumb)
+                if path is None:
+                    return None
+                digest = await asyncio.to_thread(self.cache.add, key, path)
+            except Exception as e:
+                print(f"Ошибка при загрузке медиа {channel.title}: {str(e)}")
+                return None
+            finally:
+                self.cache.discard_temp(temp_path)
+        if self.metrics is not None:
+            self.metrics.increment('media_downloads')
+        return digest
+
+    async def attach(self, client, scheduler, items):
+        """Заполняет media_file строк по парам (канал, строка, запись) параллельно"""
+        items = [(channel, row, record) for channel, row, record in items if record.media is not None]
+        results = await asyncio.gather(*(self.download(client, scheduler, channel, record)
+                                         for channel, _, record in items))
+        for (_, row, _), digest in zip(items, results):
+            row['media_file'] = digest
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
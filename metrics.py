@@ -0,0 +1,123 @@
+import asyncio
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+# Префикс имен метрик в формате Prometheus
+PROMETHEUS_PREFIX = 'telegram_crawler'
+# Счетчики, которые ведутся для каждого канала
+CHANNEL_COUNTERS = ('requests', 'messages', 'rows', 'bytes', 'flood_wait_seconds')
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metrics:
+    """Метрики одного запуска сбора данных
+
+    Содержит время этапов (подключение, список диалогов, загрузка истории,
+    запись, построение графиков), общие и поканальные счетчики запросов,
+    сообщений, байт текста и секунд FloodWait, а также глубину очередей.
+    Экспортируется в JSON или в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}
+        self.counters = {}
+        self.channels = {}
+        self.queues = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Замеряет время выполнения этапа name (время суммируется)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - started)
+
+    def add_stage_time(self, name, seconds):
+        stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+
+    def increment(self, name, value=1, channel=None):
+        """Увеличивает общий счетчик name и, если указан канал, его счетчик"""
+        self.counters[name] = self.counters.get(name, 0) + value
+        if channel is not None:
+            counters = self.channels.setdefault(channel, dict.fromkeys(CHANNEL_COUNTERS, 0))
+            counters[name] = counters.get(name, 0) + value
+
+    def observe_queue(self, name, depth):
+        """Запоминает текущую и максимальную глубину очереди"""
+        queue = self.queues.setdefault(name, {'current': 0, 'max': 0})
+        queue['current'] = depth
+        queue['max'] = max(queue['max'], depth)
+
+    def to_dict(self):
+        return {
+            'elapsed_seconds': round(time.monotonic() - self.started, 3),
+            'stages': {name: {'seconds': round(stage['seconds'], 3), 'calls': stage['calls']}
+                       for name, stage in self.stages.items()},
+            'counters': dict(self.counters),
+            'channels': {name: dict(counters) for name, counters in self.channels.items()},
+            'queues': {name: dict(queue) for name, queue in self.queues.items()},
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """Метрики в текстовом формате Prometheus"""
+        data = self.to_dict()
+        lines = [f'# TYPE {prefix}_elapsed_seconds gauge',
+                 f'{prefix}_elapsed_seconds {data["elapsed_seconds"]}']
+        lines.append(f'# TYPE {prefix}_stage_seconds counter')
+        for name, stage in data['stages'].items():
+            lines.append(f'{prefix}_stage_seconds{{stage="{_escape_label(name)}"}} {stage["seconds"]}')
+        lines.append(f'# TYPE {prefix}_stage_calls counter')
+        for name, stage in data['stages'].items():
+            lines.append(f'{prefix}_stage_calls{{stage="{_escape_label(name)}"}} {stage["calls"]}')
+        for name, value in data['counters'].items():
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total {value}')
+        for name in CHANNEL_COUNTERS:
+            lines.append(f'# TYPE {prefix}_channel_{name}_total counter')
+            for channel, counters in data['channels'].items():
+                lines.append(f'{prefix}_channel_{name}_total{{channel="{_escape_label(channel)}"}} '
+                             f'{counters.get(name, 0)}')
+        lines.append(f'# TYPE {prefix}_queue_depth gauge')
+        lines.append(f'# TYPE {prefix}_queue_depth_max gauge')
+        for name, queue in data['queues'].items():
+            lines.append(f'{prefix}_queue_depth{{queue="{_escape_label(name)}"}} {queue["current"]}')
+            lines.append(f'{prefix}_queue_depth_max{{queue="{_escape_label(name)}"}} {queue["max"]}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        """Сохраняет метрики: .prom - формат Prometheus, иначе JSON"""
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+
+    def progress_line(self):
+        counters = self.counters
+        return (f"Каналов: {counters.get('channels_done', 0)}/{counters.get('channels_found', 0)}, "
+                f"сообщений: {counters.get('messages', 0)}, "
+                f"запросов: {counters.get('requests', 0)}, "
+                f"FloodWait: {counters.get('flood_wait_seconds', 0)} с, "
+                f"прошло: {time.monotonic() - self.started:.0f} с")
+
+    async def report_progress(self, interval=1.0, stream=None):
+        """Выводит строку прогресса каждые interval секунд до отмены задачи"""
+        stream = stream or sys.stderr
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                stream.write('\r' + self.progress_line())
+                stream.flush()
+        finally:
+            stream.write('\r' + self.progress_line() + '\n')
+            stream.flush()
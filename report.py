@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from aggregation import prepare, daily_counts, build_aggregates
+
+# Каталог отчета по умолчанию
+REPORT_DIR = 'report'
+# Файл с отпечатками данных уже построенных графиков
+MANIFEST_NAME = '.manifest.json'
+REPORT_DPI = 150
+
+
+class Chart:
+    """Описание графика отчета: какой показатель каких агрегатов рисовать
+
+    В названии показателя и заголовке можно указать {window} - ширину
+    скользящего окна.
+    """
+
+    def __init__(self, name, title, ylabel, level, table, column, legend='Университет'):
+        self.name = name
+        self.title = title
+        self.ylabel = ylabel
+        self.level = level
+        self.table = table
+        self.column = column
+        self.legend = legend
+
+    def select(self, aggregates, window):
+        """Данные графика: таблица «дата x группа» выбранного показателя"""
+        column = self.column.format(window=window)
+        return aggregates[self.level][self.table][column].unstack(level=0).sort_index()
+
+
+CHARTS = [
+    Chart('daily_posts', 'Количество публикаций по дням', 'Количество публикаций',
+          'university', 'daily', 'posts'),
+    Chart('daily_posts_by_channel', 'Количество публикаций по дням по каналам',
+          'Количество публикаций', 'channel', 'daily', 'posts', legend='Канал'),
+    Chart('weekly_views', 'Просмотры по неделям', 'Просмотры', 'university', 'weekly', 'views'),
+    Chart('weekly_views_per_post', 'Просмотры на публикацию по неделям', 'Просмотров на публикацию',
+          'university', 'weekly', 'views_per_post'),
+    Chart('engagement', 'Доля репостов от просмотров за {window} дн.', 'Репосты / просмотры',
+          'university', 'rolling', 'engagement_rate_{window}d'),
+]
+
+
+def fingerprint(title, chart, data):
+    """Отпечаток входных данных и оформления графика"""
+    digest = hashlib.sha1()
+    digest.update(json.dumps([title, chart.ylabel, chart.legend, REPORT_DPI,
+                              [str(column) for column in data.columns]]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def render_chart(path, title, ylabel, legend, data):
+    """Рисует один график в файл path
+
+    Выполняется в отдельном процессе, поэтому использует неинтерактивный
+    backend Agg и не трогает общее состояние pyplot основного процесса.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+
+    fig, ax = plt.subplots(figsize=(15, 8))
+    try:
+        data.plot(ax=ax, kind='line', marker='o', linewidth=2, markersize=5)
+        ax.set_title(title, fontsize=14, pad=20)
+        ax.set_xlabel('Дата', fontsize=12)
+        ax.set_ylabel(ylabel, fontsize=12)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.legend(title=legend, fontsize=10)
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m.%Y'))
+        fig.autofmt_xdate()
+        fig.tight_layout()
+        fig.savefig(path, dpi=REPORT_DPI, bbox_inches='tight')
+    finally:
+        plt.close(fig)
+    return path
+
+
+def _build_levels(df, matcher, window, levels, daily=None):
+    if daily is None:
+        prepared = prepare(df, matcher)
+        daily = {level: daily_counts(prepared, level) for level in levels}
+    return {level: build_aggregates(daily[level], window) for level in levels}
+
+
+def _load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+async def generate_report(df, output_dir=REPORT_DIR, matcher=None, window=7, charts=None,
+                          max_workers=None, daily=None):
+    """Строит набор графиков по собранным данным
+
+    Если переданы накопленные дневные агрегаты daily ({уровень: таблица},
+    см. aggregation.load_daily_levels), графики строятся по ним и df не
+    нужен. Иначе агрегаты по университетам и каналам вычисляются по df
+    один раз. Графики рисуются параллельно в пуле процессов, не блокируя
+    цикл событий. Графики, входные данные которых не изменились с прошлого
+    запуска (по отпечаткам в output_dir/.manifest.json), пропускаются.
+    Возвращает словарь со списками построенных и пропущенных графиков.
+    """
+    result = {'rendered': [], 'skipped': []}
+    if daily is None and (df is None or df.empty):
+        print("Нет данных для построения графиков")
+        return result
+    charts = charts or CHARTS
+    os.makedirs(output_dir, exist_ok=True)
+
+    aggregates = await asyncio.to_thread(_build_levels, df, matcher, window,
+                                         {chart.level for chart in charts}, daily)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    jobs = []
+    for chart in charts:
+        title = chart.title.format(window=window)
+        data = chart.select(aggregates, window)
+        path = os.path.join(output_dir, f'{chart.name}.png')
+        key = fingerprint(title, chart, data)
+        if manifest.get(chart.name) == key and os.path.exists(path):
+            result['skipped'].append(chart.name)
+        else:
+            jobs.append((chart, title, path, key, data))
+
+    if jobs:
+        loop = asyncio.get_running_loop()
+        workers = min(len(jobs), max_workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [loop.run_in_executor(pool, render_chart, path, title, chart.ylabel,
+                                            chart.legend, data)
+                       for chart, title, path, _, data in jobs]
+            outcomes = await asyncio.gather(*futures, return_exceptions=True)
+        for (chart, _, _, key, _), outcome in zip(jobs, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"\nОшибка при построении графика {chart.name}: {str(outcome)}")
+                manifest.pop(chart.name, None)
+            else:
+                manifest[chart.name] = key
+                result['rendered'].append(chart.name)
+
+    with open(manifest_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    print(f"\nГрафиков построено: {len(result['rendered'])}, "
+          f"без изменений: {len(result['skipped'])} (каталог {output_dir})")
+    return result
+
+
+def print_summary(df):
+    """Вывод общей статистики собранных данных"""
+    try:
+        print("\nОбщая статистика:\n"
+              f"Всего публикаций: {len(df)}\n"
+              f"Количество уникальных каналов/групп: {df['university'].nunique()}\n"
+              f"Среднее количество просмотров: {df['views'].mean():.2f}\n"
+              f"Среднее количество репостов: {df['forwards'].mean():.2f}")
+    except Exception as e:
+        print(f"\nОшибка при подсчете статистики: {str(e)}")
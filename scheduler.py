@@ -0,0 +1,188 @@
+import asyncio
+from telethon.errors import FloodWaitError
+
+# Начальная и предельные скорости запросов (запросов в секунду)
+DEFAULT_RATE = 3.0
+MIN_RATE = 0.2
+MAX_RATE = 10.0
+# Прирост скорости после каждого успешного запроса
+RATE_STEP = 0.05
+# Сколько запросов можно сделать подряд без ожидания
+DEFAULT_BURST = 10
+# Сколько раз подряд повторять запрос после FloodWait
+MAX_FLOOD_RETRIES = 5
+# Telethon получает историю и диалоги пачками по 100 элементов за запрос
+ITER_BATCH_SIZE = 100
+
+
+def advance_history(kwargs, message):
+    """Сдвигает параметры iter_messages так, чтобы продолжить после message"""
+    kwargs['offset_id'] = message.id
+    kwargs.pop('offset_date', None)
+    if kwargs.get('limit') is not None:
+        kwargs['limit'] -= 1
+
+
+class RequestScheduler:
+    """Планировщик запросов к Telegram с общим бюджетом
+
+    Все запросы проходят через общее «ведро токенов» со скоростью rate.
+    При FloodWaitError планировщик приостанавливает все запросы ровно на
+    e.seconds, вдвое снижает скорость и затем постепенно наращивает ее
+    после успешных запросов. Итерация по истории после FloodWait
+    продолжается с последнего полученного сообщения. Ожидания дольше
+    max_flood_wait секунд не выполняются, а FloodWaitError передается
+    вызывающему коду (например, пулу аккаунтов для перераспределения).
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 burst=DEFAULT_BURST, max_flood_retries=MAX_FLOOD_RETRIES, max_flood_wait=None):
+        if rate <= 0 or min_rate <= 0 or max_rate < min_rate:
+            raise ValueError("Некорректные ограничения скорости запросов")
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.max_flood_retries = max_flood_retries
+        self.max_flood_wait = max_flood_wait
+        self.requests = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0
+        self.metrics = None
+        self._tokens = float(burst)
+        self._updated = None
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def attach_metrics(self, metrics):
+        """Подключает сбор метрик запросов и FloodWait"""
+        self.metrics = metrics
+
+    async def acquire(self, key=None):
+        """Ожидает разрешения на очередной запрос (key - канал для метрик)"""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.requests += 1
+                    if self.metrics is not None:
+                        self.metrics.increment('requests', channel=key)
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self):
+        """Плавно увеличивает скорость после успешного запроса"""
+        self.rate = min(self.max_rate, self.rate + RATE_STEP)
+
+    async def wait_flood(self, seconds, key=None):
+        """Приостанавливает все запросы на время, указанное сервером"""
+        loop = asyncio.get_running_loop()
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        if self.metrics is not None:
+            self.metrics.increment('flood_waits')
+            self.metrics.increment('flood_wait_seconds', seconds, channel=key)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        # Токены, накопленные до паузы, не должны тратиться сразу после нее
+        self._tokens = 0.0
+        self._updated = None
+        print(f"Превышен лимит запросов, ожидание {seconds} секунд...")
+        await asyncio.sleep(seconds)
+
+    async def _handle_flood(self, error, retries, key=None):
+        if retries > self.max_flood_retries:
+            raise error
+        if self.max_flood_wait is not None and error.seconds > self.max_flood_wait:
+            raise error
+        await self.wait_flood(error.seconds, key)
+
+    async def _call(self, key, func, *args, **kwargs):
+        retries = 0
+        while True:
+            await self.acquire(key)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                retries += 1
+                await self._handle_flood(e, retries, key)
+                continue
+            self.on_success()
+            return result
+
+    async def call(self, func, *args, **kwargs):
+        """Выполняет запрос с учетом бюджета и повтором после FloodWait"""
+        return await self._call(None, func, *args, **kwargs)
+
+    async def request(self, client, entity, make_request):
+        """Выполняет запрос make_request(entity) к сущности канала"""
+        return await self._call(getattr(entity, 'title', None), client, make_request(entity))
+
+    async def download_media(self, client, entity, media, **kwargs):
+        """Загружает вложение сообщения канала через client.download_media"""
+        return await self._call(getattr(entity, 'title', None), client.download_media, media, **kwargs)
+
+    async def iter_messages(self, client, entity, **kwargs):
+        """Итерация по истории канала с продолжением после FloodWait
+
+        Параметры передаются в client.iter_messages. После паузы запрос
+        повторяется с offset_id последнего полученного сообщения.
+        """
+        key = getattr(entity, 'title', None)
+        retries = 0
+        while True:
+            await self.acquire(key)
+            count = 0
+            try:
+                async for message in client.iter_messages(entity, **kwargs):
+                    count += 1
+                    if count % ITER_BATCH_SIZE == 0:
+                        self.on_success()
+                        await self.acquire(key)
+                    # Запоминаем позицию, с которой нужно продолжить
+                    advance_history(kwargs, message)
+                    retries = 0
+                    yield message
+                self.on_success()
+                return
+            except FloodWaitError as e:
+                retries += 1
+                await self._handle_flood(e, retries, key)
+
+    async def iter_dialogs(self, client, **kwargs):
+        """Итерация по диалогам с продолжением после FloodWait
+
+        Диалоги, полученные до паузы, повторно не выдаются.
+        """
+        seen = set()
+        retries = 0
+        while True:
+            await self.acquire()
+            count = 0
+            try:
+                async for dialog in client.iter_dialogs(**kwargs):
+                    count += 1
+                    if count % ITER_BATCH_SIZE == 0:
+                        self.on_success()
+                        await self.acquire()
+                    if dialog.id in seen:
+                        continue
+                    seen.add(dialog.id)
+                    retries = 0
+                    yield dialog
+                self.on_success()
+                return
+            except FloodWaitError as e:
+                retries += 1
+                await self._handle_flood(e, retries)
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import json
+import os
+from telethon.errors import FloodWaitError
+from scheduler import RequestScheduler, advance_history
+
+# FloodWait дольше этого времени (в секундах) переводит каналы аккаунта на другие аккаунты
+LONG_FLOOD_WAIT = 300
+# Каталог, в котором процессы аккаунтов (SHARD) сохраняют списки видимых им каналов
+SHARD_DIR = 'shards'
+
+
+class Account:
+    """Аккаунт Telegram в пуле: клиент и собственный планировщик запросов"""
+
+    def __init__(self, name, client, scheduler=None):
+        self.name = name
+        self.client = client
+        self.scheduler = scheduler or RequestScheduler(max_flood_wait=LONG_FLOOD_WAIT)
+        self.blocked_until = 0.0
+
+
+def shard_order(key, names):
+    """Порядок аккаунтов для ключа по рандеву-хешированию
+
+    Для каждого канала порядок стабилен между запусками и процессами,
+    а при добавлении или удалении аккаунта меняется назначение только
+    части каналов.
+    """
+    return sorted(names,
+                  key=lambda name: hashlib.sha1(f'{name}:{key}'.encode()).hexdigest(),
+                  reverse=True)
+
+
+def save_visible_channels(name, channel_ids, shard_dir=SHARD_DIR):
+    """Сохраняет id каналов, видимых аккаунту name, для процессов других аккаунтов"""
+    os.makedirs(shard_dir, exist_ok=True)
+    path = os.path.join(shard_dir, f'{name}.json')
+    # Запись через временный файл, чтобы другие процессы не прочитали его наполовину
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        json.dump(sorted(channel_ids), file)
+    os.replace(path + '.tmp', path)
+
+
+def load_visible_channels(names, shard_dir=SHARD_DIR):
+    """Каналы, видимые аккаунтам names, по сохраненным спискам: {имя: множество id}
+
+    Аккаунты, процессы которых еще не сохраняли список, пропускаются.
+    """
+    visible = {}
+    for name in names:
+        path = os.path.join(shard_dir, f'{name}.json')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                visible[name] = set(json.load(file))
+    return visible
+
+
+class AccountPool:
+    """Пул аккаунтов с распределением каналов между ними
+
+    Совместим по интерфейсу с RequestScheduler и может передаваться в
+    collect_telegram_data вместо него. Каждый канал обрабатывается первым
+    доступным аккаунтом в порядке shard_order среди аккаунтов, которым
+    канал виден. Если аккаунт получает долгий FloodWait, он исключается
+    на это время, а загрузка продолжается другим аккаунтом с того же места.
+
+    shard_names - имена всех аккаунтов, если они запущены в отдельных
+    процессах: тогда этот процесс обрабатывает только каналы, для которых
+    первым в shard_order идет один из его аккаунтов. Аккаунты других
+    процессов учитываются, только если канал есть в сохраненном ими списке
+    видимых каналов (каталог shard_dir), иначе канал обрабатывает этот
+    процесс. Каждый процесс сохраняет такой список после обхода диалогов.
+    Перераспределение при долгом FloodWait возможно только между
+    аккаунтами одного процесса.
+    """
+
+    def __init__(self, accounts, shard_names=None, shard_dir=SHARD_DIR):
+        if not accounts:
+            raise ValueError("Пул аккаунтов не может быть пустым")
+        self.accounts = {account.name: account for account in accounts}
+        self.shard_names = list(shard_names) if shard_names else list(self.accounts)
+        self.shard_dir = shard_dir
+        # Аккаунты, запущенные в других процессах, и видимые им каналы
+        self.remote_names = [name for name in self.shard_names if name not in self.accounts]
+        self._visible = load_visible_channels(self.remote_names, shard_dir) if self.remote_names else {}
+        # Сущности каналов в каждом аккаунте: {id канала: {имя аккаунта: диалог}}
+        self._entities = {}
+
+    @property
+    def client(self):
+        """Клиент первого аккаунта пула"""
+        return next(iter(self.accounts.values())).client
+
+    def attach_metrics(self, metrics):
+        """Подключает сбор метрик к планировщикам всех аккаунтов"""
+        for account in self.accounts.values():
+            account.scheduler.attach_metrics(metrics)
+
+    def owns(self, channel_id):
+        """Обрабатывается ли канал аккаунтами этого процесса
+
+        Аккаунты других процессов, которым канал не виден (или список
+        видимых каналов которых неизвестен), не могут его обработать.
+        """
+        names = [name for name in self.shard_names
+                 if name in self.accounts or channel_id in self._visible.get(name, ())]
+        return shard_order(channel_id, names)[0] in self.accounts
+
+    def assign(self, channel_id):
+        """Выбирает аккаунт для канала
+
+        Возвращает первый незаблокированный аккаунт в порядке shard_order,
+        а если заблокированы все - тот, что освободится раньше.
+        """
+        names = [name for name in self._entities.get(channel_id, self.accounts)
+                 if name in self.accounts]
+        order = [self.accounts[name] for name in shard_order(channel_id, names or self.accounts)]
+        now = asyncio.get_running_loop().time()
+        for account in order:
+            if account.blocked_until <= now:
+                return account
+        return min(order, key=lambda account: account.blocked_until)
+
+    def block(self, account, seconds):
+        """Исключает аккаунт из распределения на seconds секунд"""
+        now = asyncio.get_running_loop().time()
+        account.blocked_until = max(account.blocked_until, now + seconds)
+        print(f"Аккаунт {account.name} ограничен на {seconds} секунд, "
+              "его каналы переходят к другим аккаунтам")
+
+    async def _ready(self, channel_id):
+        account = self.assign(channel_id)
+        delay = account.blocked_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return account
+
+    def _entity(self, account, entity):
+        return self._entities.get(entity.id, {}).get(account.name, entity)
+
+    async def _list_dialogs(self, account, **kwargs):
+        """Все диалоги аккаунта или None, если обход прерван FloodWait"""
+        try:
+            return [dialog async for dialog in account.scheduler.iter_dialogs(account.client, **kwargs)]
+        except FloodWaitError as e:
+            # Диалоги этого аккаунта, скорее всего, видны и другим аккаунтам
+            self.block(account, e.seconds)
+            return None
+
+    async def iter_dialogs(self, client=None, **kwargs):
+        """Диалоги всех аккаунтов пула без повторов
+
+        Диалоги выдаются только после обхода всех аккаунтов (параллельно):
+        иначе каналы, найденные первым аккаунтом, назначались бы ему, пока
+        неизвестно, видны ли они остальным, и распределение зависело бы от
+        скорости обхода. Параметр client оставлен для совместимости с
+        RequestScheduler.
+        """
+        accounts = list(self.accounts.values())
+        listed = await asyncio.gather(*(self._list_dialogs(account, **kwargs) for account in accounts))
+        for account, dialogs in zip(accounts, listed):
+            # Неполный список после FloodWait не сохраняется: иначе другие процессы
+            # решили бы, что остальные каналы этому аккаунту не видны
+            if dialogs is None:
+                continue
+            for dialog in dialogs:
+                self._entities.setdefault(dialog.id, {})[account.name] = dialog
+            if self.remote_names:
+                save_visible_channels(account.name, {dialog.id for dialog in dialogs}, self.shard_dir)
+        seen = set()
+        for dialogs in listed:
+            for dialog in dialogs or ():
+                if dialog.id in seen or not self.owns(dialog.id):
+                    continue
+                seen.add(dialog.id)
+                yield dialog
+
+    async def iter_messages(self, client, entity, **kwargs):
+        """История канала через назначенный аккаунт с переходом на другой при долгом FloodWait"""
+        while True:
+            account = await self._ready(entity.id)
+            try:
+                async for message in account.scheduler.iter_messages(
+                        account.client, self._entity(account, entity), **kwargs):
+                    advance_history(kwargs, message)
+                    yield message
+                return
+            except FloodWaitError as e:
+                self.block(account, e.seconds)
+
+    async def request(self, client, entity, make_request):
+        """Запрос к каналу через назначенный аккаунт"""
+        while True:
+            account = await self._ready(entity.id)
+            try:
+                return await account.scheduler.request(
+                    account.client, self._entity(account, entity), make_request)
+            except FloodWaitError as e:
+                self.block(account, e.seconds)
+
+    async def download_media(self, client, entity, media, **kwargs):
+        """Загрузка вложения через назначенный аккаунт: ссылки на файлы действуют только для него"""
+        while True:
+            account = await self._ready(entity.id)
+            try:
+                return await account.scheduler.download_media(
+                    account.client, self._entity(account, entity), media, **kwargs)
+            except FloodWaitError as e:
+                self.block(account, e.seconds)
@@ -0,0 +1,126 @@
+import sqlite3
+import pandas as pd
+
+# Файл хранилища сообщений по умолчанию
+STORE_PATH = 'telegram_stats.sqlite'
+
+# Колонки метаданных вложений, которые добавляются к строкам сообщений (MEDIA=1).
+# Определены здесь, а не в media.py, чтобы чтение данных не загружало telethon
+MEDIA_COLUMNS = ['media_type', 'file_size', 'reactions', 'replies', 'media_file']
+
+# Колонки таблицы сообщений в порядке хранения
+STORE_COLUMNS = ['channel_id', 'message_id', 'university', 'publication_date', 'date',
+                 'message', 'views', 'forwards'] + MEDIA_COLUMNS
+# Типы колонок метаданных вложений, добавленных после создания таблицы
+MEDIA_COLUMN_TYPES = {'media_type': 'TEXT', 'file_size': 'INTEGER', 'reactions': 'INTEGER',
+                      'replies': 'INTEGER', 'media_file': 'TEXT'}
+
+
+class MessageStore:
+    """Хранилище собранных сообщений в SQLite без повторов
+
+    Сообщение однозначно определяется парой (channel_id, message_id),
+    поэтому повторные и пересекающиеся запуски не создают дубликатов:
+    новые сообщения добавляются, а у существующих обновляются текст и
+    счетчики. Индексы по университету и дате позволяют выбирать данные
+    для графиков и выгрузки, не читая тексты сообщений.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        # Запись идет из потока писателя, а обращения к хранилищу не пересекаются
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                university TEXT NOT NULL,
+                publication_date TEXT NOT NULL,
+                date TEXT NOT NULL,
+                message TEXT,
+                views INTEGER NOT NULL,
+                forwards INTEGER NOT NULL,
+                PRIMARY KEY (channel_id, message_id)
+            );
+            CREATE INDEX IF NOT EXISTS messages_university_date ON messages (university, date);
+            CREATE INDEX IF NOT EXISTS messages_date ON messages (date);
+        """)
+        # Хранилища прошлых версий дополняются колонками метаданных
+        existing = {row[1] for row in self.connection.execute("PRAGMA table_info(messages)")}
+        for column in MEDIA_COLUMNS:
+            if column not in existing:
+                self.connection.execute(
+                    f"ALTER TABLE messages ADD COLUMN {column} {MEDIA_COLUMN_TYPES[column]}")
+        self.connection.commit()
+
+    def upsert_rows(self, rows):
+        """Добавляет строки сообщений, обновляя уже сохраненные
+
+        Метаданные вложений из строк без них (сбор без MEDIA) не стираются.
+        """
+        self.connection.executemany(
+            """INSERT INTO messages
+                   (channel_id, message_id, university, publication_date, date,
+                    message, views, forwards, media_type, file_size, reactions, replies, media_file)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(channel_id, message_id) DO UPDATE SET
+                   university = excluded.university,
+                   message = excluded.message,
+                   views = excluded.views,
+                   forwards = excluded.forwards,
+                   media_type = COALESCE(excluded.media_type, media_type),
+                   file_size = COALESCE(excluded.file_size, file_size),
+                   reactions = COALESCE(excluded.reactions, reactions),
+                   replies = COALESCE(excluded.replies, replies),
+                   media_file = COALESCE(excluded.media_file, media_file)""",
+            [(row['channel_id'], row['message_id'], row['university'],
+              row['publication_date'].isoformat(), row['publication_date'].strftime('%Y-%m-%d'),
+              row['message'], row['views'], row['forwards'])
+             + tuple(row.get(column) for column in MEDIA_COLUMNS)
+             for row in rows]
+        )
+        self.connection.commit()
+
+    def update_counters(self, channel_id, counters):
+        """Обновляет счетчики сообщений канала: {message_id: (views, forwards)}"""
+        self.connection.executemany(
+            """UPDATE messages SET views = ?, forwards = ?
+               WHERE channel_id = ? AND message_id = ?""",
+            [(views, forwards, channel_id, message_id)
+             for message_id, (views, forwards) in counters.items()]
+        )
+        self.connection.commit()
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def load(self, columns=None, universities=None, start_date=None, end_date=None):
+        """Загружает сообщения в DataFrame
+
+        Читаются только колонки columns, фильтры по университетам и датам
+        (строки YYYY-MM-DD включительно) выполняются по индексам.
+        """
+        columns = list(columns) if columns else STORE_COLUMNS
+        unknown = set(columns) - set(STORE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Неизвестные колонки: {', '.join(sorted(unknown))}")
+        conditions = []
+        params = []
+        if universities is not None:
+            universities = list(universities)
+            conditions.append(f"university IN ({', '.join('?' * len(universities))})")
+            params.extend(universities)
+        if start_date is not None:
+            conditions.append("date >= ?")
+            params.append(str(start_date))
+        if end_date is not None:
+            conditions.append("date <= ?")
+            params.append(str(end_date))
+        query = f"SELECT {', '.join(columns)} FROM messages"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY university, publication_date"
+        return pd.read_sql_query(query, self.connection, params=params)
+
+    def close(self):
+        self.connection.close()
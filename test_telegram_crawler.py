@@ -1,9 +1,10 @@
 import pytest
 import asyncio
 from unittest.mock import AsyncMock, MagicMock, patch
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import os
+import time
 from telethon.tl.types import Channel, Message
 from telethon.errors import FloodWaitError, SessionPasswordNeededError, ApiIdInvalidError
 
@@ -27,6 +28,7 @@ def mock_client():
 @pytest.fixture
 def mock_message():
     message = MagicMock(spec=Message)
+    message.id = 1
     message.date = datetime.now()
     message.text = "Test message"
     message.views = 100
@@ -194,4 +196,1139 @@ async def test_collect_telegram_data_statistics(mock_client, mock_channel, mock_
         assert 'views' in result.columns
         assert 'forwards' in result.columns
     finally:
-        await mock_client.disconnect() 
\ No newline at end of file
+        await mock_client.disconnect() 
+
+def make_async_iter(items):
+    """Возвращает функцию, создающую новый асинхронный итератор при каждом вызове"""
+    def factory(*args, **kwargs):
+        async def iterator():
+            for item in items:
+                yield item
+        return iterator()
+    return factory
+
+
+def make_channel(channel_id, title):
+    channel = MagicMock(spec=Channel)
+    channel.id = channel_id
+    channel.title = title
+    return channel
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_concurrent_limit(mock_client, mock_message, tmp_path, monkeypatch):
+    """Тест ограничения числа одновременно обрабатываемых каналов"""
+    monkeypatch.chdir(tmp_path)
+    channels = [make_channel(i, f"МГУ канал {i}") for i in range(6)]
+    mock_client.iter_dialogs = MagicMock(side_effect=make_async_iter(channels))
+
+    active = 0
+    max_active = 0
+
+    def iter_messages(channel, **kwargs):
+        async def iterator():
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            yield mock_message
+        return iterator()
+    mock_client.iter_messages = MagicMock(side_effect=iter_messages)
+
+    result = await collect_telegram_data(mock_client, max_concurrency=2)
+
+    assert len(result) == 6
+    assert max_active == 2
+    assert sorted(result['university']) == sorted(channel.title for channel in channels)
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_channel_isolation(mock_client, mock_message, tmp_path, monkeypatch):
+    """Тест изоляции ошибок отдельных каналов при параллельном сборе"""
+    monkeypatch.chdir(tmp_path)
+    good = make_channel(1, "МГУ новости")
+    bad = make_channel(2, "СПбГУ новости")
+    mock_client.iter_dialogs = MagicMock(side_effect=make_async_iter([bad, good]))
+
+    def iter_messages(channel, **kwargs):
+        if channel is bad:
+            raise Exception("Test error")
+        return make_async_iter([mock_message])()
+    mock_client.iter_messages = MagicMock(side_effect=iter_messages)
+
+    result = await collect_telegram_data(mock_client)
+
+    assert list(result['university']) == [good.title]
+
+
+@pytest.mark.asyncio
+async def test_process_channel_incremental(mock_client, mock_channel, mock_message, tmp_path):
+    """Тест инкрементального сбора с контрольными точками"""
+    from checkpoints import CheckpointStore
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    mock_message.id = 42
+    mock_message.date = datetime.now().astimezone()
+    mock_client.iter_messages = MagicMock(side_effect=make_async_iter([mock_message]))
+
+    result = await process_channel(mock_client, mock_channel, store)
+    store.commit()
+
+    assert len(result) == 1
+    assert store.get_last_message_id(mock_channel.id) == 42
+    assert 'min_id' not in mock_client.iter_messages.call_args.kwargs
+
+    # Повторный запуск запрашивает только новые сообщения и обновляет счетчики
+    views = MagicMock(views=150, forwards=12)
+    mock_client.side_effect = AsyncMock(return_value=MagicMock(views=[views]))
+    mock_client.iter_messages = MagicMock(side_effect=make_async_iter([]))
+
+    result = await process_channel(mock_client, mock_channel, store)
+
+    assert result == []
+    assert mock_client.iter_messages.call_args.kwargs['min_id'] == 42
+    assert store.get_counters(mock_channel.id) == {42: (150, 12)}
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_checkpoint_rollback(mock_client, mock_channel, mock_message, tmp_path, monkeypatch):
+    """Тест: контрольная точка не сохраняется, если данные не записаны"""
+    from checkpoints import CheckpointStore
+    monkeypatch.chdir(tmp_path)
+    store = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    mock_message.id = 7
+    mock_message.date = datetime.now().astimezone()
+    mock_client.iter_dialogs = MagicMock(side_effect=make_async_iter([make_channel(1, "МГУ")]))
+    mock_client.iter_messages = MagicMock(side_effect=make_async_iter([mock_message]))
+
+    with patch('pandas.DataFrame.to_csv', side_effect=PermissionError):
+        result = await collect_telegram_data(mock_client, checkpoints=store)
+
+    assert result is None
+    assert store.get_last_message_id(1) is None
+    store.close()
+
+
+def make_flood_wait(seconds):
+    error = FloodWaitError(request=None)
+    error.seconds = seconds
+    return error
+
+
+@pytest.mark.asyncio
+async def test_scheduler_resumes_history_after_flood_wait(mock_client, mock_channel):
+    """Тест продолжения загрузки истории с места остановки после FloodWait"""
+    from scheduler import RequestScheduler
+    messages = [MagicMock(id=i) for i in (5, 4, 3, 2, 1)]
+    calls = []
+
+    def iter_messages(channel, **kwargs):
+        calls.append(dict(kwargs))
+        async def iterator():
+            for message in messages:
+                if 'offset_id' in kwargs and message.id >= kwargs['offset_id']:
+                    continue
+                if len(calls) == 1 and message.id == 3:
+                    raise make_flood_wait(0)
+                yield message
+        return iterator()
+    mock_client.iter_messages = MagicMock(side_effect=iter_messages)
+
+    scheduler = RequestScheduler(rate=2.0)
+    with patch('scheduler.asyncio.sleep', wraps=asyncio.sleep) as sleep:
+        result = [m.id async for m in scheduler.iter_messages(mock_client, mock_channel, offset_date=datetime.now())]
+
+    assert result == [5, 4, 3, 2, 1]
+    assert calls[1] == {'offset_id': 4}
+    assert scheduler.flood_waits == 1
+    assert scheduler.rate < 2.0
+    sleep.assert_any_call(0)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_call_gives_up_after_retries():
+    """Тест отказа после исчерпания повторов FloodWait"""
+    from scheduler import RequestScheduler
+    request = AsyncMock(side_effect=make_flood_wait(0))
+    scheduler = RequestScheduler(max_flood_retries=2)
+
+    with pytest.raises(FloodWaitError):
+        await scheduler.call(request)
+
+    assert request.call_count == 3
+    assert scheduler.flood_waits == 2
+
+
+@pytest.mark.asyncio
+async def test_iter_channel_batches_batch_size(mock_client, mock_channel, mock_message):
+    """Тест разбиения сообщений канала на пачки для потоковой записи"""
+    from data_collector import iter_channel_batches
+    mock_client.iter_messages = MagicMock(side_effect=make_async_iter([mock_message] * 5))
+
+    batches = [batch async for batch in iter_channel_batches(mock_client, mock_channel, batch_size=2)]
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_csv_stream_writer_append(tmp_path):
+    """Тест потоковой записи пачек с одним заголовком при дозаписи"""
+    from writers import CsvStreamWriter
+    path = str(tmp_path / 'stats.csv')
+
+    def row(message_id):
+        return {'channel_id': 1, 'message_id': message_id, 'university': 'МГУ',
+                'publication_date': datetime.now(), 'message': 'text', 'views': 1, 'forwards': 0}
+
+    for first in (1, 4):
+        queue = asyncio.Queue()
+        for item in ([row(first)], [row(first + 1), row(first + 2)], None):
+            queue.put_nowait(item)
+        writer = CsvStreamWriter(path, append=True)
+        await writer.run(queue)
+        assert writer.rows_written == 3
+
+    # Уже записанные сообщения при дозаписи пропускаются
+    queue = asyncio.Queue()
+    for item in ([row(6), row(7)], None):
+        queue.put_nowait(item)
+    writer = CsvStreamWriter(path, append=True)
+    await writer.run(queue)
+    assert writer.rows_written == 1
+
+    df = pd.read_csv(path)
+    assert list(df['message_id']) == list(range(1, 8))
+    assert list(df.columns) == list(row(1))
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_parquet(mock_client, mock_message, tmp_path, monkeypatch):
+    """Тест записи в Parquet с разбиением по университету и дате"""
+    from writers import load_stats
+    monkeypatch.chdir(tmp_path)
+    mock_message.date = datetime(2024, 3, 1, 12, 0).astimezone()
+    channels = [make_channel(1, "МГУ новости"), make_channel(2, "СПбГУ новости")]
+    mock_client.iter_dialogs = MagicMock(side_effect=make_async_iter(channels))
+    mock_client.iter_messages = MagicMock(side_effect=make_async_iter([mock_message]))
+
+    result = await collect_telegram_data(mock_client, output_format='parquet',
+                                         columns=['university', 'views'],
+                                         start_date='2024-02-01', end_date='2024-03-01')
+
+    assert sorted(result['university']) == ["МГУ новости", "СПбГУ новости"]
+    assert list(result.columns) == ['university', 'views']
+    assert (tmp_path / 'telegram_stats_parquet').is_dir()
+
+    only_msu = load_stats('telegram_stats_parquet', columns=['views'],
+                          universities=["МГУ новости"], start_date='2024-03-01')
+    assert len(only_msu) == 1
+    assert len(load_stats('telegram_stats_parquet', start_date='2024-03-02')) == 0
+
+
+def test_university_matcher_classify():
+    """Тест классификации названий каналов скомпилированным шаблоном"""
+    from matcher import UniversityMatcher
+    matcher = UniversityMatcher({
+        'МГУ': ['мгу', 'мгу им. ломоносова', 'msu'],
+        'СПбГУ': ['спбгу', 'spbu'],
+        'МГТУ': ['мгту', 'бауманка'],
+    })
+
+    assert matcher.classify('Новости МГУ') == 'МГУ'
+    assert matcher.classify('МГУ  им. Ломоносова') == 'МГУ'
+    assert matcher.classify('SPbU Official') == 'СПбГУ'
+    assert matcher.classify('Бауманка и МГУ') == 'МГТУ'
+    assert matcher.classify('Студенты МГТУ') == 'МГТУ'
+    assert matcher.classify('Погода в Москве') is None
+
+
+def test_university_matcher_from_file():
+    """Тест загрузки университетов из конфигурационного файла"""
+    from matcher import UniversityMatcher
+    matcher = UniversityMatcher.from_file()
+
+    assert matcher.classify('Санкт-Петербургский государственный университет') == 'СПбГУ'
+    assert matcher.classify('Lomonosov Moscow State University') == 'МГУ'
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_lean_fetch(mock_client, mock_message, tmp_path, monkeypatch):
+    """Тест экономной загрузки: без личных диалогов и пауз между пачками"""
+    from data_collector import MessageRecord
+    monkeypatch.chdir(tmp_path)
+    user_dialog = MagicMock(id=5, title="МГУ чат с другом", is_user=True)
+    channel = make_channel(1, "МГУ")
+    mock_client.iter_dialogs = MagicMock(side_effect=make_async_iter([user_dialog, channel]))
+    mock_client.iter_messages = MagicMock(side_effect=make_async_iter([mock_message]))
+
+    result = await collect_telegram_data(mock_client)
+
+    assert list(result['university']) == ["МГУ"]
+    assert mock_client.iter_dialogs.call_args.kwargs['ignore_migrated'] is True
+    assert mock_client.iter_messages.call_count == 1
+    assert mock_client.iter_messages.call_args.kwargs['wait_time'] == 0
+
+    record = MessageRecord.from_message(mock_message)
+    assert (record.id, record.views, record.text) == (1, 100, "Test message")
+    assert not hasattr(record, '__dict__')
+
+
+def test_shard_order_consistent():
+    """Тест стабильного распределения каналов при добавлении аккаунта"""
+    from sharding import shard_order
+    names = ['first', 'second', 'third']
+    owners = {channel_id: shard_order(channel_id, names)[0] for channel_id in range(300)}
+
+    assert set(owners.values()) == set(names)
+    assert owners == {channel_id: shard_order(channel_id, names)[0] for channel_id in range(300)}
+
+    # Новый аккаунт забирает каналы только себе, остальные назначения не меняются
+    extended = {channel_id: shard_order(channel_id, names + ['fourth'])[0] for channel_id in range(300)}
+    moved = [channel_id for channel_id in owners if extended[channel_id] != owners[channel_id]]
+    assert all(extended[channel_id] == 'fourth' for channel_id in moved)
+
+
+@pytest.mark.asyncio
+async def test_account_pool_rebalances_on_long_flood_wait(mock_channel):
+    """Тест перехода канала на другой аккаунт при долгом FloodWait"""
+    from sharding import Account, AccountPool, shard_order
+    messages = [MagicMock(id=i) for i in (3, 2, 1)]
+    owner, other = shard_order(mock_channel.id, ['a', 'b'])
+
+    def make_client(fail):
+        client = MagicMock()
+        def iter_messages(channel, **kwargs):
+            async def iterator():
+                for message in messages:
+                    if message.id >= kwargs.get('offset_id', 4):
+                        continue
+                    if fail and message.id == 2:
+                        raise make_flood_wait(1000)
+                    yield message
+            return iterator()
+        client.iter_messages = MagicMock(side_effect=iter_messages)
+        return client
+
+    clients = {owner: make_client(True), other: make_client(False)}
+    pool = AccountPool([Account(name, client) for name, client in clients.items()])
+
+    result = [m.id async for m in pool.iter_messages(None, mock_channel)]
+
+    assert result == [3, 2, 1]
+    assert clients[other].iter_messages.call_args.kwargs == {'offset_id': 3}
+    assert pool.assign(mock_channel.id).name == other
+
+
+@pytest.fixture
+def collected_df():
+    return pd.DataFrame({
+        'university': ['МГУ новости', 'МГУ новости', 'СПбГУ', 'Новости МГУ'],
+        'publication_date': ['2024-03-01 10:00:00+03:00', '2024-03-04 01:00:00+03:00',
+                             '2024-03-01 23:30:00+03:00', '2024-03-03 10:00:00+03:00'],
+        'message': ['a', 'b', 'c', 'd'],
+        'views': [100, 200, 50, 0],
+        'forwards': [10, 0, 5, 0],
+    })
+
+
+def test_aggregation_daily_weekly_rolling(collected_df):
+    """Тест дневных, недельных и скользящих агрегатов по университетам"""
+    from aggregation import prepare, daily_counts, build_aggregates
+    daily = daily_counts(prepare(collected_df))
+    aggregates = build_aggregates(daily, window=3)
+
+    assert daily.loc[('МГУ', pd.Timestamp('2024-03-01'))].tolist() == [1, 100, 10]
+    assert aggregates['daily'].loc[('СПбГУ', pd.Timestamp('2024-03-01')), 'engagement_rate'] == 0.1
+    assert aggregates['weekly'].loc[('МГУ', pd.Timestamp('2024-02-26')), 'posts'] == 2
+    rolling = aggregates['rolling']
+    assert rolling.loc[('МГУ', pd.Timestamp('2024-03-02')), 'posts_3d'] == 1
+    assert rolling.loc[('СПбГУ', pd.Timestamp('2024-03-04')), 'views_3d'] == 0
+    assert len(daily_counts(prepare(collected_df), 'channel').index.unique('channel')) == 3
+
+
+def test_aggregation_incremental_update(collected_df, tmp_path):
+    """Тест: дозапись новых дней дает тот же результат, что и полный пересчет"""
+    from aggregation import prepare, daily_counts, update_daily
+    path = str(tmp_path / 'daily.csv')
+
+    update_daily(collected_df.iloc[:2], path)
+    daily = update_daily(collected_df.iloc[2:], path)
+
+    pd.testing.assert_frame_equal(daily, daily_counts(prepare(collected_df)), check_dtype=False,
+                                  check_index_type=False)
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_fake_client_with_flood_waits(tmp_path, monkeypatch):
+    """Тест полного сбора на локальной замене Telegram с FloodWait"""
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=4, messages_per_channel=500, days=60,
+                                flood_every=9, empty_every=10)
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+
+    result = await collect_telegram_data(client, scheduler=scheduler)
+
+    assert client.flood_waits > 0
+    assert scheduler.flood_waits == client.flood_waits
+    # Загружается половина сообщений за последние 30 дней, каждое десятое без текста
+    assert len(result) == 4 * 225
+    assert result['university'].nunique() == 4
+
+
+@pytest.mark.asyncio
+async def test_run_benchmark_reports_metrics():
+    """Тест замера производительности на синтетических данных"""
+    from benchmark import run_benchmark, compare
+    result = await run_benchmark(channels=2, messages=300, latency=0.001)
+
+    assert result['rows'] == 300
+    assert result['messages_per_sec'] > 0
+    assert result['time_to_first_write'] is not None
+    assert compare(result, dict(result, messages_per_sec=result['messages_per_sec'] * 2), 0.2)
+    assert compare(result, result, 0.2) == []
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_metrics(tmp_path, monkeypatch):
+    """Тест сбора метрик этапов, каналов и очередей"""
+    from fake_telegram import FakeTelegramClient
+    from metrics import Metrics
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=2, messages_per_channel=400, days=61,
+                                flood_every=4, empty_every=4)
+    metrics = Metrics()
+
+    started = time.perf_counter()
+    await collect_telegram_data(client, metrics=metrics,
+                                scheduler=RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000))
+    elapsed = time.perf_counter() - started
+
+    data = metrics.to_dict()
+    assert {'dialogs', 'history', 'history_workers', 'write', 'load'} <= set(data['stages'])
+    # history - реальное время, а не сумма по параллельным воркерам
+    assert data['stages']['history']['calls'] == 1
+    assert data['stages']['history']['seconds'] <= elapsed
+    assert data['counters']['channels_found'] == data['counters']['channels_done'] == 2
+    assert data['counters']['requests'] >= client.requests
+    assert data['counters']['flood_waits'] == client.flood_waits
+    channel = data['channels']["МГУ канал 0"]
+    assert channel['messages'] == 197
+    assert channel['rows'] == 147
+    assert channel['bytes'] > 0
+    assert 'batches' in data['queues']
+
+    prometheus = metrics.to_prometheus()
+    assert 'telegram_crawler_channel_rows_total{channel="МГУ канал 0"} 147' in prometheus
+    assert 'telegram_crawler_stage_seconds{stage="history"}' in prometheus
+
+
+@pytest.mark.asyncio
+async def test_authenticate_client_non_interactive(mock_client, tmp_path, monkeypatch):
+    """Тест неинтерактивной авторизации: без ввода с клавиатуры и запроса кода"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('API_ID', '12345')
+    monkeypatch.setenv('API_HASH', 'test_hash')
+    with patch('auth.TelegramClient', return_value=mock_client), \
+            patch('builtins.input', side_effect=AssertionError("input не должен вызываться")):
+        # Нет файла сессии
+        with pytest.raises(ValueError):
+            await authenticate_client('missing', interactive=False)
+        assert not mock_client.connect.called
+
+        # Файл сессии есть, но она не авторизована
+        (tmp_path / 'stale.session').write_bytes(b'')
+        with pytest.raises(Exception, match='не авторизована'):
+            await authenticate_client('stale', interactive=False)
+        assert not mock_client.send_code_request.called
+
+        mock_client.is_user_authorized = AsyncMock(return_value=True)
+        assert await authenticate_client('stale', interactive=False) is mock_client
+
+
+@pytest.mark.asyncio
+async def test_authenticate_clients_concurrent(tmp_path, monkeypatch):
+    """Тест одновременной неинтерактивной авторизации нескольких сессий"""
+    from auth import authenticate_clients
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('API_ID', '12345')
+    monkeypatch.setenv('API_HASH', 'test_hash')
+    active = 0
+    max_active = 0
+
+    async def slow_connect():
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    def make_client(*args, **kwargs):
+        client = MagicMock()
+        client.connect = AsyncMock(side_effect=slow_connect)
+        client.is_user_authorized = AsyncMock(return_value=True)
+        client.disconnect = AsyncMock(return_value=None)
+        return client
+
+    names = ['first', 'second', 'third']
+    for name in names:
+        (tmp_path / f'{name}.session').write_bytes(b'')
+    with patch('auth.TelegramClient', side_effect=make_client):
+        clients = await authenticate_clients(names, interactive=False)
+    assert [name for name, _ in clients] == names
+    assert max_active == len(names)
+
+
+@pytest.mark.asyncio
+async def test_run_daemon_live_updates(tmp_path, monkeypatch):
+    """Тест постоянного режима: догрузка истории и запись новых сообщений из обновлений"""
+    from daemon import run_daemon
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=2, messages_per_channel=20, days=20)
+    channel_id = client.dialogs[0].id
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    # Прошлый запуск остановился на 10-м сообщении каждого канала
+    for dialog in client.dialogs[::2]:
+        checkpoints.set_last_message_id(dialog.id, 10)
+    stop = asyncio.Event()
+    daemon = asyncio.create_task(run_daemon(
+        client, checkpoints, scheduler=RequestScheduler(rate=1000, max_rate=1000, burst=1000),
+        flush_interval=0.01, sweep_interval=3600, stop=stop))
+    while len(client.handlers) < 2 or checkpoints.get_last_message_id(channel_id) < 20:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+
+    # Уже догруженное сообщение пропускается, новое дописывается
+    await client.publish(channel_id, 20, "Повтор")
+    await client.publish(channel_id, 21, "Новое сообщение", views=5)
+    await client.publish(channel_id, 20, "Исправлено", views=999, forwards=7, edited=True)
+    await asyncio.sleep(0.05)
+    stop.set()
+    await daemon
+
+    df = pd.read_csv(tmp_path / 'telegram_stats.csv')
+    assert len(df) == 2 * 10 + 1
+    assert df['message'].iloc[-1] == "Новое сообщение"
+    assert "Повтор" not in set(df['message'])
+    assert client.handlers == []
+    reopened = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    assert reopened.get_last_message_id(channel_id) == 21
+    assert reopened.get_counters(channel_id)[20] == (999, 7)
+    reopened.close()
+    checkpoints.close()
+
+
+@pytest.mark.asyncio
+async def test_run_daemon_catch_up_respects_lookback(tmp_path, monkeypatch):
+    """Тест постоянного режима: без контрольных точек история догружается только за период"""
+    from daemon import run_daemon
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=2, messages_per_channel=20, days=20)
+    channel_id = client.dialogs[0].id
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    stop = asyncio.Event()
+    daemon = asyncio.create_task(run_daemon(
+        client, checkpoints, scheduler=RequestScheduler(rate=1000, max_rate=1000, burst=1000),
+        flush_interval=0.01, sweep_interval=3600, stop=stop, lookback_days=5))
+    while len(client.handlers) < 2 or (checkpoints.get_last_message_id(channel_id) or 0) < 20:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    stop.set()
+    await daemon
+
+    df = pd.read_csv(tmp_path / 'telegram_stats.csv')
+    # Сообщения публикуются раз в день, в период попадают последние 5 дней
+    assert len(df) == 2 * 5
+    checkpoints.close()
+
+
+@pytest.mark.asyncio
+async def test_run_daemon_catch_up_includes_messages_before_subscription(tmp_path, monkeypatch):
+    """Тест постоянного режима: сообщения, опубликованные до подписки на обновления, догружаются"""
+    from daemon import run_daemon
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    # Последние сообщения опубликованы позже начала запуска, но до подписки
+    client = FakeTelegramClient(channels=1, messages_per_channel=20, days=20,
+                                now=datetime.now(timezone.utc) + timedelta(hours=36))
+    channel_id = client.dialogs[0].id
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    stop = asyncio.Event()
+    daemon = asyncio.create_task(run_daemon(
+        client, checkpoints, scheduler=RequestScheduler(rate=1000, max_rate=1000, burst=1000),
+        flush_interval=0.01, sweep_interval=3600, stop=stop, lookback_days=5))
+    while len(client.handlers) < 2 or (checkpoints.get_last_message_id(channel_id) or 0) < 20:
+        await asyncio.sleep(0.01)
+    await client.publish(channel_id, 21, "Новое сообщение")
+    await asyncio.sleep(0.05)
+    stop.set()
+    await daemon
+
+    df = pd.read_csv(tmp_path / 'telegram_stats.csv')
+    assert {19, 20, 21} <= set(df['message_id'])
+    assert df['message_id'].is_unique
+    checkpoints.close()
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_sqlite_store_dedup(tmp_path, monkeypatch):
+    """Тест хранилища SQLite: повторный сбор не создает дубликатов"""
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    from store import MessageStore
+    from writers import load_stats
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=2, messages_per_channel=100, days=60)
+    path = str(tmp_path / 'stats.sqlite')
+
+    for _ in range(2):
+        result = await collect_telegram_data(
+            client, output_format='sqlite', output_path=path,
+            scheduler=RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000))
+        assert len(result) == 100
+
+    store = MessageStore(path)
+    try:
+        assert store.count() == 100
+        channel_id = client.dialogs[0].id
+        store.update_counters(channel_id, {100: (12345, 67)})
+        row = store.load(universities=['МГУ канал 0']).set_index('message_id').loc[100]
+        assert (row['views'], row['forwards']) == (12345, 67)
+        assert row['channel_id'] == channel_id
+    finally:
+        store.close()
+
+    only_msu = load_stats(path, columns=['university', 'views'], universities=['МГУ канал 0'])
+    assert list(only_msu.columns) == ['university', 'views']
+    assert len(only_msu) == 50
+
+
+@pytest.mark.asyncio
+async def test_generate_report_skips_unchanged_charts(collected_df, tmp_path):
+    """Тест отчета: графики строятся в пуле процессов и не перерисовываются без изменений"""
+    from report import generate_report, CHARTS
+    output_dir = str(tmp_path / 'report')
+
+    first = await generate_report(collected_df, output_dir, window=3, max_workers=2)
+    assert sorted(first['rendered']) == sorted(chart.name for chart in CHARTS)
+    for chart in CHARTS:
+        assert os.path.getsize(os.path.join(output_dir, f'{chart.name}.png')) > 0
+
+    second = await generate_report(collected_df, output_dir, window=3, max_workers=2)
+    assert second['rendered'] == []
+
+    # Такое же сообщение СПбГУ не меняет просмотры на публикацию и долю репостов
+    changed = pd.concat([collected_df, collected_df.iloc[[2]]], ignore_index=True)
+    third = await generate_report(changed, output_dir, window=3, max_workers=2)
+    assert 'daily_posts' in third['rendered']
+    assert third['skipped'] == ['weekly_views_per_post', 'engagement']
+
+
+@pytest.mark.asyncio
+async def test_generate_report_from_daily_aggregates(collected_df, tmp_path):
+    """Тест отчета по сохраненным дневным агрегатам: те же графики без обработки сообщений"""
+    from aggregation import update_daily_levels, load_daily_levels
+    from report import generate_report, CHARTS
+    output_dir = str(tmp_path / 'report')
+    paths = {'university': str(tmp_path / 'daily.csv'), 'channel': str(tmp_path / 'daily_channel.csv')}
+    await generate_report(collected_df, output_dir, window=3, max_workers=2)
+
+    update_daily_levels(collected_df.iloc[:2], paths)
+    update_daily_levels(collected_df.iloc[2:], paths)
+    with patch('report.prepare', side_effect=AssertionError):
+        result = await generate_report(None, output_dir, window=3, max_workers=2,
+                                       daily=load_daily_levels(paths))
+
+    # Агрегаты из файлов совпадают с вычисленными по сообщениям, поэтому графики не перерисовываются
+    assert sorted(result['skipped']) == sorted(chart.name for chart in CHARTS)
+
+
+def test_analyze_messages_near_duplicates_and_cache(tmp_path):
+    """Тест анализа текстов: хештеги, ссылки, почти одинаковые сообщения и кэш"""
+    from text_analytics import analyze_messages
+    announcement = ("Приглашаем абитуриентов и их родителей на день открытых дверей университета, "
+                    "который пройдет в субботу в главном здании. Расскажем о факультетах, "
+                    "правилах приема, общежитиях и студенческой жизни #абитуриент https://msu.ru/open")
+    df = pd.DataFrame({
+        'university': ['МГУ', 'Новости МГУ', 'СПбГУ', 'СПбГУ'],
+        'message': [announcement,
+                    announcement + " Регистрация обязательна",
+                    "Студенты заняли первое место на олимпиаде по программированию #олимпиада",
+                    None],
+    })
+    cache_path = str(tmp_path / 'text_cache.sqlite')
+
+    results = analyze_messages(df, cache_path)
+    duplicates = results['duplicates']
+    assert sorted(duplicates['university']) == ['МГУ', 'Новости МГУ']
+    assert duplicates['group'].nunique() == 1
+    assert results['hashtags'].set_index('hashtag').loc['абитуриент', 'count'] == 2
+    assert results['domains'].iloc[0].tolist() == ['msu.ru', 2]
+    assert 'абитуриентов' in set(results['keywords']['word'])
+
+    # Повторный запуск берет результаты из кэша
+    with patch('text_analytics.extract_features', side_effect=AssertionError):
+        cached = analyze_messages(df, cache_path)
+    pd.testing.assert_frame_equal(cached['keywords'], results['keywords'])
+    assert len(cached['duplicates']) == 2
+
+
+def test_analyze_messages_skips_duplicates_within_channel(tmp_path):
+    """Тест: повторы внутри одного канала не считаются дубликатами"""
+    from text_analytics import analyze_messages
+    reminder = ("Напоминаем студентам о продлении срока подачи заявлений на стипендию "
+                "до конца месяца в деканате факультета")
+    df = pd.DataFrame({
+        'university': ['СПбГУ', 'СПбГУ', 'МГУ'],
+        'message': [reminder, reminder, "Открыт набор на летние курсы иностранных языков"],
+    })
+    cache_path = str(tmp_path / 'text_cache.sqlite')
+
+    assert analyze_messages(df, cache_path)['duplicates'].empty
+    duplicates = analyze_messages(df, cache_path, across_channels=False)['duplicates']
+    assert duplicates['university'].tolist() == ['СПбГУ', 'СПбГУ']
+
+
+def test_cli_help_does_not_import_heavy_dependencies():
+    """Тест: разбор команд не загружает pandas, matplotlib и telethon"""
+    import subprocess
+    import sys
+    code = ("import sys, main; main.build_parser().parse_args(['export', 'out.csv']); "
+            "print(sorted(m for m in ('pandas', 'matplotlib', 'telethon') if m in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    assert output.strip() == '[]'
+
+
+def test_reading_data_does_not_import_telethon():
+    """Тест: команды export и report читают данные и строят отчет без загрузки telethon"""
+    import subprocess
+    import sys
+    code = "import sys, writers, store, report; print('telethon' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    assert output.strip() == 'False'
+
+
+def test_cli_export_filters(collected_df, tmp_path, capsys):
+    """Тест выгрузки собранных данных командой export"""
+    from main import main
+    source = tmp_path / 'stats.csv'
+    collected_df.to_csv(source, index=False)
+    output = tmp_path / 'export.csv'
+
+    code = main(['export', str(output), '--source', str(source), '--universities', 'МГУ новости',
+                 '--columns', 'university,views', '--end', '2024-03-02'])
+
+    assert code == 0
+    exported = pd.read_csv(output)
+    assert list(exported.columns) == ['university', 'views']
+    assert exported['views'].tolist() == [100]
+    assert "Выгружено 1 строк" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_iter_channel_batches_slices_long_history(monkeypatch):
+    """Тест загрузки длинной истории срезами: параллельно, по порядку и с повтором среза"""
+    import data_collector
+    from data_collector import iter_channel_batches
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.setattr(data_collector, 'SLICE_SIZE', 300)
+    monkeypatch.setattr(data_collector, 'SLICE_RETRY_DELAY', 0)
+    client = FakeTelegramClient(channels=1, messages_per_channel=5000, days=60, latency=0.005)
+    channel = client.dialogs[0]
+    active = 0
+    max_active = 0
+    failed = []
+    iter_messages = client.iter_messages
+
+    async def tracked_iter_messages(entity, **kwargs):
+        nonlocal active, max_active
+        # Срез 4101-4400 один раз завершается ошибкой
+        if kwargs.get('max_id') == 4401 and not failed:
+            failed.append(kwargs)
+            raise ConnectionError("соединение разорвано")
+        active += 1
+        max_active = max(max_active, active)
+        try:
+            async for message in iter_messages(entity, **kwargs):
+                yield message
+        finally:
+            active -= 1
+
+    client.iter_messages = tracked_iter_messages
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+
+    ids = []
+    async for batch in iter_channel_batches(client, channel, scheduler=scheduler):
+        ids.extend(row['message_id'] for row in batch)
+
+    # Сообщения за последние 30 дней - вторая половина истории,
+    # срезы ниже начала периода не загружаются
+    assert ids == list(range(5000, 2500, -1))
+    assert failed
+    assert max_active > 1
+
+
+def test_resolve_date_range():
+    """Тест границ периода сбора: даты без пояса считаются московскими, конечная дата включительно"""
+    from data_collector import resolve_date_range
+    start, end = resolve_date_range('2024-03-01', '2024-03-10')
+    assert start.isoformat() == '2024-03-01T00:00:00+03:00'
+    assert end.isoformat() == '2024-03-11T00:00:00+03:00'
+
+    start, end = resolve_date_range(end_date=datetime(2024, 3, 10, 12, 0), lookback_days=7)
+    assert end.isoformat() == '2024-03-10T12:00:00+03:00'
+    assert end - start == timedelta(days=7)
+
+    with pytest.raises(ValueError):
+        resolve_date_range('2024-03-10', '2024-03-01')
+
+
+@pytest.mark.asyncio
+async def test_iter_channel_batches_date_range(monkeypatch):
+    """Тест сбора за заданный период: загрузка начинается с конца периода и останавливается на его начале"""
+    import data_collector
+    from data_collector import iter_channel_batches, resolve_date_range
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.setattr(data_collector, 'SLICE_SIZE', 5)
+    # Сообщение i опубликовано в 12:00 UTC за 100 - i дней до 10.04.2024
+    client = FakeTelegramClient(channels=1, messages_per_channel=100, days=100,
+                                now=datetime(2024, 4, 10, 12, 0, tzinfo=timezone.utc))
+    channel = client.dialogs[0]
+    requested = []
+    iter_messages = client.iter_messages
+
+    def tracked_iter_messages(entity, **kwargs):
+        requested.append(kwargs)
+        return iter_messages(entity, **kwargs)
+
+    client.iter_messages = tracked_iter_messages
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+
+    ids = []
+    date_range = resolve_date_range('2024-03-01', '2024-03-10')
+    async for batch in iter_channel_batches(client, channel, scheduler=scheduler, date_range=date_range):
+        ids.extend(row['message_id'] for row in batch)
+
+    assert ids == list(range(69, 59, -1))
+    # Нижняя граница срезов находится одним запросом по дате начала периода
+    assert any(kwargs.get('limit') == 1 for kwargs in requested)
+    assert all(kwargs['max_id'] > 60 for kwargs in requested if kwargs.get('max_id'))
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_media_cache(tmp_path, monkeypatch):
+    """Тест сбора метаданных вложений и загрузки миниатюр в кэш без повторов"""
+    from fake_telegram import FakeTelegramClient
+    from media import MediaCache, MediaCollector
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    # Каждое десятое сообщение - фото без подписи, одно и то же во всех каналах
+    client = FakeTelegramClient(channels=2, messages_per_channel=100, days=60,
+                                empty_every=5, media_every=10)
+
+    for _ in range(2):
+        cache = MediaCache(str(tmp_path / 'media_cache'))
+        media = MediaCollector(cache, concurrency=2)
+        try:
+            result = await collect_telegram_data(
+                client, media=media,
+                scheduler=RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000))
+        finally:
+            media.close()
+        # Фото за последние 30 дней (60, 70, ..., 100) загружаются один раз на все каналы и запуски
+        assert client.downloads == 5
+
+    # Сообщения без текста сохраняются, если у них есть вложение
+    assert len(result) == 2 * 45
+    photos = result[result['media_type'] == 'photo']
+    assert len(photos) == 10
+    assert photos['message'].isna().all()
+    assert sorted(photos['reactions'].unique()) == sorted({i % 7 for i in range(60, 101, 10)})
+    assert (photos['file_size'] == 200000).all()
+    assert photos['media_file'].nunique() == 5
+    with open(cache.path(photos['media_file'].iloc[0]), encoding='utf-8') as file:
+        assert file.read().endswith(' m')
+
+
+@pytest.mark.asyncio
+async def test_media_collector_cleans_temp_files_after_retries(tmp_path, monkeypatch):
+    """Тест: недокачанные при FloodWait файлы и файлы прошлых запусков не остаются в tmp"""
+    from fake_telegram import FakeTelegramClient
+    from media import MediaCache, MediaCollector
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    stale = tmp_path / 'media_cache' / 'tmp' / 'stale.jpg'
+    stale.parent.mkdir(parents=True)
+    stale.write_bytes(b'partial')
+    os.utime(stale, (0, 0))
+    fresh = stale.with_name('fresh.jpg')
+    fresh.write_bytes(b'partial')
+    # Каждый третий запрос, в том числе во время загрузки, получает короткий FloodWait
+    client = FakeTelegramClient(channels=2, messages_per_channel=100, days=60,
+                                media_every=10, flood_every=3, flood_seconds=0)
+    cache = MediaCache(str(tmp_path / 'media_cache'))
+    assert not stale.exists() and fresh.exists()
+    fresh.unlink()
+    media = MediaCollector(cache)
+    try:
+        result = await collect_telegram_data(
+            client, media=media,
+            scheduler=RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000))
+    finally:
+        media.close()
+
+    assert result['media_file'].notna().sum() == 10
+    assert os.listdir(tmp_path / 'media_cache' / 'tmp') == []
+
+
+def test_message_record_keeps_media_only_for_downloads():
+    """Тест: вложение Telethon хранится в записи, только если файлы загружаются"""
+    from data_collector import MessageRecord
+    from fake_telegram import FakeTelegramClient
+    client = FakeTelegramClient(channels=1, messages_per_channel=10, days=10, media_every=10)
+    message = client.make_message(client.dialogs[0].id, 10)
+
+    record = MessageRecord.from_message(message)
+    assert (record.media_type, record.file_size, record.media) == ('photo', 200000, None)
+    assert MessageRecord.from_message(message, keep_media=True).media is message.media
+
+
+def test_media_cache_lru_eviction(tmp_path):
+    """Тест кэша медиа: одинаковое содержимое хранится один раз, давно не использованное удаляется"""
+    from media import MediaCache
+    cache = MediaCache(str(tmp_path / 'cache'), max_bytes=10)
+
+    def add(key, data):
+        path = cache.temp_path()
+        with open(path, 'wb') as file:
+            file.write(data)
+        return cache.add(key, path)
+
+    try:
+        first = add('photo:1:thumb', b'aaaa')
+        assert add('photo:2:thumb', b'aaaa') == first
+        second = add('photo:3:thumb', b'bbbb')
+        assert cache.size() == 8
+        # После обращения к первому файлу дольше всего не использовался второй
+        assert cache.lookup('photo:1:thumb') == first
+        third = add('photo:4:thumb', b'cccc')
+
+        assert cache.size() == 8
+        assert cache.lookup('photo:3:thumb') is None
+        assert not os.path.exists(cache.path(second))
+        assert cache.lookup('photo:2:thumb') == first
+        assert os.path.exists(cache.path(third))
+    finally:
+        cache.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('output_format, refreshes', [('csv', False), ('sqlite', True)])
+async def test_collect_telegram_data_refreshes_counters_only_for_store(output_format, refreshes,
+                                                                        tmp_path, monkeypatch):
+    """Тест: счетчики запрашиваются повторно, только если их можно записать в данные"""
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=2, messages_per_channel=50, days=10)
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+    counter_requests = []
+    request = scheduler.request
+
+    async def tracked_request(client, entity, make_request):
+        counter_requests.append(entity.id)
+        return await request(client, entity, make_request)
+
+    scheduler.request = tracked_request
+    try:
+        for _ in range(2):
+            await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler,
+                                        output_format=output_format)
+    finally:
+        checkpoints.close()
+
+    assert bool(counter_requests) == refreshes
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_append_skips_written_rows(tmp_path, monkeypatch):
+    """Тест: после сбоя канала повторный запуск не дописывает уже записанные строки"""
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=1, messages_per_channel=1500, days=20)
+    channel_id = client.dialogs[0].id
+    iter_messages = client.iter_messages
+    fail = [True]
+
+    async def failing_iter_messages(entity, **kwargs):
+        count = 0
+        async for message in iter_messages(entity, **kwargs):
+            count += 1
+            if fail[0] and count > 1200:
+                raise ConnectionError("соединение разорвано")
+            yield message
+
+    client.iter_messages = failing_iter_messages
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+    try:
+        # Первые две пачки канала записаны, но контрольная точка не сохранена
+        first = await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler)
+        assert len(first) == 1000
+        assert checkpoints.get_last_message_id(channel_id) is None
+
+        fail[0] = False
+        second = await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler)
+    finally:
+        checkpoints.close()
+
+    assert len(second) == 1500
+    assert second['message_id'].is_unique
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+async def test_collect_telegram_data_append_rejects_other_columns(tmp_path, monkeypatch, capsys,
+                                                                  output_format):
+    """Тест: дозапись с другим набором колонок отклоняется до загрузки сообщений"""
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from media import MediaCollector
+    from scheduler import RequestScheduler
+    from writers import load_stats
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=1, messages_per_channel=50, days=20, media_every=10)
+    channel_id = client.dialogs[0].id
+    path = str(tmp_path / ('stats.csv' if output_format == 'csv' else 'stats_parquet'))
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+    try:
+        # Первый запуск без метаданных вложений
+        first = await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler,
+                                            output_format=output_format, output_path=path)
+        assert len(first) == 50
+        client.messages_per_channel = 60
+        client.now += 10 * client.step
+        requests = client.requests
+        written = load_stats(path)
+
+        result = await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler,
+                                             output_format=output_format, output_path=path,
+                                             media=MediaCollector())
+        assert checkpoints.get_last_message_id(channel_id) == 50
+    finally:
+        checkpoints.close()
+
+    assert result is None
+    assert "Укажите новый OUTPUT_PATH" in capsys.readouterr().out
+    assert client.requests == requests
+    pd.testing.assert_frame_equal(load_stats(path), written)
+
+
+@pytest.mark.asyncio
+async def test_account_pool_shard_keeps_channels_invisible_to_owner(tmp_path):
+    """Тест режима SHARD: канал, не видимый аккаунту-владельцу, обрабатывает текущий процесс"""
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    from sharding import Account, AccountPool, save_visible_channels, shard_order
+    shard_dir = str(tmp_path / 'shards')
+    client = FakeTelegramClient(channels=20, messages_per_channel=1)
+    channel_ids = [dialog.id for dialog in client.dialogs]
+    foreign = [i for i in channel_ids if shard_order(i, ['a', 'b'])[0] == 'b']
+    assert foreign
+
+    def make_pool():
+        return AccountPool([Account('a', client, RequestScheduler(rate=1000, max_rate=1000, burst=1000))],
+                           shard_names=['a', 'b'], shard_dir=shard_dir)
+
+    # Список аккаунта b неизвестен: все каналы обрабатывает a
+    pool = make_pool()
+    assert {dialog.id async for dialog in pool.iter_dialogs()} == set(channel_ids)
+    assert (tmp_path / 'shards' / 'a.json').exists()
+
+    # Аккаунт b видит только половину своих каналов
+    save_visible_channels('b', foreign[::2], shard_dir)
+    pool = make_pool()
+    owned = {dialog.id async for dialog in pool.iter_dialogs()}
+    assert owned == set(channel_ids) - set(foreign[::2])
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_account_pool_follows_shard_order(tmp_path, monkeypatch):
+    """Тест пула аккаунтов: каналы распределяются по shard_order, а не по скорости обхода диалогов"""
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    from sharding import Account, AccountPool, shard_order
+    monkeypatch.chdir(tmp_path)
+    # Аккаунт b обходит диалоги заметно медленнее a
+    clients = {'a': FakeTelegramClient(channels=20, messages_per_channel=5, days=5),
+               'b': FakeTelegramClient(channels=20, messages_per_channel=5, days=5, latency=0.02)}
+    channels = {}
+    for name, client in clients.items():
+        iter_messages = client.iter_messages
+
+        def counting_iter_messages(entity, *args, _name=name, _iter=iter_messages, **kwargs):
+            channels.setdefault(_name, set()).add(entity.id)
+            return _iter(entity, *args, **kwargs)
+
+        client.iter_messages = counting_iter_messages
+    pool = AccountPool([Account(name, client, RequestScheduler(rate=1000, max_rate=1000, burst=1000))
+                        for name, client in clients.items()])
+
+    result = await collect_telegram_data(clients['a'], scheduler=pool)
+
+    assert len(result) == 20 * 5
+    channel_ids = channels['a'] | channels['b']
+    assert len(channel_ids) == 20
+    assert channels == {name: {i for i in channel_ids if shard_order(i, ['a', 'b'])[0] == name}
+                        for name in clients}
+
+
+@pytest.mark.asyncio
+async def test_collect_telegram_data_updates_daily_aggregates(tmp_path, monkeypatch):
+    """Тест: дневные агрегаты пересчитываются по дням новых сообщений и не удваиваются"""
+    from aggregation import prepare, daily_counts, load_daily
+    from checkpoints import CheckpointStore
+    from fake_telegram import FakeTelegramClient
+    from scheduler import RequestScheduler
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(channels=2, messages_per_channel=100, days=10,
+                                now=datetime.now(timezone.utc) - timedelta(days=1))
+    checkpoints = CheckpointStore(str(tmp_path / 'checkpoints.sqlite'))
+    scheduler = RequestScheduler(rate=1000, min_rate=1000, max_rate=1000, burst=1000)
+    daily_paths = {'university': str(tmp_path / 'daily.csv'),
+                   'channel': str(tmp_path / 'daily_channel.csv')}
+    try:
+        await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler,
+                                    daily_paths=daily_paths)
+        # Новые сообщения того же дня дописываются к уже посчитанным
+        client.messages_per_channel = 103
+        client.now += 3 * client.step
+        result = await collect_telegram_data(client, checkpoints=checkpoints, scheduler=scheduler,
+                                             daily_paths=daily_paths)
+    finally:
+        checkpoints.close()
+
+    assert len(result) == 2 * 103
+    for level, path in daily_paths.items():
+        pd.testing.assert_frame_equal(load_daily(path), daily_counts(prepare(result), level),
+                                      check_dtype=False, check_index_type=False, check_freq=False)
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+# Кэш результатов обработки сообщений по умолчанию
+TEXT_CACHE_PATH = 'text_cache.sqlite'
+# Каталог с результатами анализа текстов по умолчанию
+TEXT_ANALYTICS_DIR = 'text_analytics'
+# Сколько сообщений обрабатывается за один проход
+TEXT_BATCH_SIZE = 1000
+
+# Число хеш-функций MinHash и число полос LSH (в каждой полосе MINHASH_SIZE // LSH_BANDS значений)
+MINHASH_SIZE = 64
+LSH_BANDS = 16
+# Длина шингла в словах
+SHINGLE_SIZE = 3
+# Сообщения короче этого числа слов не сравниваются:
+# у коротких текстов слишком много случайных совпадений
+MIN_DUPLICATE_WORDS = 5
+# Минимальная оценка сходства Жаккара для почти одинаковых сообщений
+DUPLICATE_THRESHOLD = 0.8
+
+HASHTAG_PATTERN = re.compile(r'#(\w+)')
+LINK_PATTERN = re.compile(r'https?://[^\s<>()"\']+')
+WORD_PATTERN = re.compile(r'[^\W\d_]{3,}')
+
+# Служебные слова, не несущие смысла для частотного анализа
+STOP_WORDS = frozenset("""
+это как так что для все или при его она они оно был была были быть без под над
+про через который которая которые также тоже если уже еще ещё только можно будет
+наш наши нас вас вам мы вы вот где когда чем от из по на не да но то же ли the and for
+""".split())
+
+# Параметры хеш-функций MinHash: h(x) = (a * x + b) mod p, фиксированы для совместимости кэша
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_random = np.random.RandomState(20240301)
+_HASH_A = _random.randint(1, (1 << 61) - 1, size=MINHASH_SIZE, dtype=np.uint64)
+_HASH_B = _random.randint(0, (1 << 61) - 1, size=MINHASH_SIZE, dtype=np.uint64)
+
+
+def text_key(text):
+    """Ключ кэша: хеш текста, поэтому одинаковые сообщения обрабатываются один раз"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def tokenize(text):
+    """Слова сообщения в нижнем регистре без ссылок и чисел"""
+    return WORD_PATTERN.findall(LINK_PATTERN.sub(' ', text).lower().replace('ё', 'е'))
+
+
+def minhash(words):
+    """Подпись MinHash множества шинглов из SHINGLE_SIZE слов
+
+    Для текстов короче MIN_DUPLICATE_WORDS слов возвращается None.
+    """
+    if len(words) < MIN_DUPLICATE_WORDS:
+        return None
+    shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((int.from_bytes(hashlib.md5(s.encode('utf-8')).digest()[:4], 'little')
+                          for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Переполнение uint64 при умножении допустимо: оно только перемешивает значения
+    return ((np.outer(hashes, _HASH_A) + _HASH_B) % _MERSENNE_PRIME).min(axis=0)
+
+
+def extract_features(texts):
+    """Хештеги, ссылки, слова и подпись MinHash для пачки текстов
+
+    Хештеги и ссылки извлекаются векторно для всей пачки.
+    """
+    series = pd.Series(list(texts), dtype=object)
+    hashtags = series.str.lower().str.findall(HASHTAG_PATTERN)
+    links = series.str.findall(LINK_PATTERN)
+    features = []
+    for text, text_hashtags, text_links in zip(series, hashtags, links):
+        words = tokenize(text)
+        features.append({
+            'hashtags': text_hashtags,
+            'links': text_links,
+            'words': [word for word in words if word not in STOP_WORDS],
+            'minhash': minhash(words),
+        })
+    return features
+
+
+class TextCache:
+    """Кэш обработки сообщений в SQLite по хешу текста"""
+
+    def __init__(self, path=TEXT_CACHE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS text_features (
+                text_key TEXT PRIMARY KEY,
+                hashtags TEXT NOT NULL,
+                links TEXT NOT NULL,
+                words TEXT NOT NULL,
+                minhash BLOB
+            )
+        """)
+        self.connection.commit()
+
+    def get_many(self, keys):
+        """Сохраненные результаты для ключей keys: {ключ: признаки}"""
+        result = {}
+        keys = list(keys)
+        # Ограничение SQLite на число параметров запроса
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT text_key, hashtags, links, words, minhash FROM text_features "
+                f"WHERE text_key IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            for key, hashtags, links, words, signature in rows:
+                result[key] = {
+                    'hashtags': json.loads(hashtags),
+                    'links': json.loads(links),
+                    'words': json.loads(words),
+                    'minhash': np.frombuffer(signature, dtype='<u8') if signature else None,
+                }
+        return result
+
+    def put_many(self, items):
+        """Сохраняет результаты: пары (ключ, признаки)"""
+        self.connection.executemany(
+            """INSERT OR REPLACE INTO text_features (text_key, hashtags, links, words, minhash)
+               VALUES (?, ?, ?, ?, ?)""",
+            [(key, json.dumps(features['hashtags'], ensure_ascii=False),
+              json.dumps(features['links'], ensure_ascii=False),
+              json.dumps(features['words'], ensure_ascii=False),
+              features['minhash'].astype('<u8').tobytes() if features['minhash'] is not None else None)
+             for key, features in items]
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def find_near_duplicates(signatures, threshold=DUPLICATE_THRESHOLD, bands=LSH_BANDS):
+    """Группы почти одинаковых сообщений по подписям MinHash
+
+    Вместо попарного сравнения подписи раскладываются по корзинам LSH:
+    кандидатами считаются только сообщения, совпавшие хотя бы в одной
+    полосе, и для них оценка сходства сверяется с threshold.
+    Возвращает список групп индексов (только группы из двух и более).
+    """
+    indices = [i for i, signature in enumerate(signatures) if signature is not None]
+    parent = {i: i for i in indices}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows = MINHASH_SIZE // bands
+    for band in range(bands):
+        buckets = {}
+        for i in indices:
+            key = signatures[i][band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(i)
+        for members in buckets.values():
+            first = members[0]
+            for other in members[1:]:
+                root_first, root_other = find(first), find(other)
+                if root_first == root_other:
+                    continue
+                if np.mean(signatures[first] == signatures[other]) >= threshold:
+                    parent[root_other] = root_first
+
+    groups = {}
+    for i in indices:
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def _top(counter, name, top):
+    return pd.DataFrame(counter.most_common(top), columns=[name, 'count'])
+
+
+def analyze_messages(df, cache_path=TEXT_CACHE_PATH, top=20, threshold=DUPLICATE_THRESHOLD,
+                     batch_size=TEXT_BATCH_SIZE, across_channels=True):
+    """Анализ текстов собранных сообщений
+
+    Возвращает словарь таблиц: частые слова (keywords), хештеги (hashtags),
+    домены ссылок (domains) и группы почти одинаковых сообщений в разных
+    местах (duplicates: номер группы и строки исходных данных). При
+    across_channels=True остаются только группы из двух и более разных
+    каналов (channel_id, а если его нет - university): повторы внутри одного
+    канала не считаются. Результаты обработки каждого текста сохраняются в
+    кэше cache_path, поэтому при повторном запуске обрабатываются только
+    новые сообщения.
+    """
+    texts = df['message'].fillna('').astype(str).tolist()
+    keys = [text_key(text) for text in texts]
+    cache = TextCache(cache_path)
+    try:
+        features = cache.get_many(set(keys))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in features:
+                missing.setdefault(key, text)
+        missing = list(missing.items())
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            computed = list(zip([key for key, _ in batch],
+                                extract_features([text for _, text in batch])))
+            cache.put_many(computed)
+            features.update(computed)
+    finally:
+        cache.close()
+    if missing:
+        print(f"Обработано новых текстов: {len(missing)}, из кэша: {len(set(keys)) - len(missing)}")
+
+    keywords, hashtags, domains = Counter(), Counter(), Counter()
+    for key in keys:
+        item = features[key]
+        keywords.update(item['words'])
+        hashtags.update(item['hashtags'])
+        domains.update(link.split('/')[2].lower() for link in item['links'] if link.count('/') >= 2)
+
+    groups = find_near_duplicates([features[key]['minhash'] for key in keys], threshold)
+    if across_channels:
+        channels = df['channel_id' if 'channel_id' in df.columns else 'university'].tolist()
+        groups = [members for members in groups
+                  if len({channels[i] for i in members}) > 1]
+    duplicates = []
+    for number, members in enumerate(sorted(groups, key=len, reverse=True), 1):
+        group = df.iloc[members].copy()
+        group.insert(0, 'group', number)
+        duplicates.append(group)
+    duplicates = (pd.concat(duplicates, ignore_index=True) if duplicates
+                  else pd.DataFrame(columns=['group'] + list(df.columns)))
+
+    return {
+        'keywords': _top(keywords, 'word', top),
+        'hashtags': _top(hashtags, 'hashtag', top),
+        'domains': _top(domains, 'domain', top),
+        'duplicates': duplicates,
+    }
+
+
+def save_text_analytics(results, output_dir=TEXT_ANALYTICS_DIR):
+    """Сохраняет таблицы анализа текстов в CSV-файлы каталога output_dir"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name, table in results.items():
+        table.to_csv(os.path.join(output_dir, f'{name}.csv'), index=False)
+    print(f"\nРезультаты анализа текстов сохранены в {output_dir}")
@@ -0,0 +1,316 @@
+import asyncio
+import os
+import shutil
+import uuid
+import pandas as pd
+from store import MessageStore, STORE_PATH
+
+# Файл с результатами по умолчанию
+STATS_PATH = 'telegram_stats.csv'
+# Каталог колоночного набора данных по умолчанию
+PARQUET_PATH = 'telegram_stats_parquet'
+# Колонки, по которым разбивается набор данных Parquet
+PARTITION_COLUMNS = ['university', 'date']
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'sqlite')
+
+# Часовой пояс дат публикации и границ периода без явного пояса
+TIMEZONE = 'Europe/Moscow'
+
+# Колонки, необходимые для построения графиков
+VISUALIZATION_COLUMNS = ['university', 'publication_date', 'views', 'forwards']
+
+
+class StreamWriter:
+    """Базовый класс потоковой записи собранных сообщений
+
+    Получает из очереди пачки строк (списки словарей) и сразу записывает
+    их на диск, поэтому в памяти держится не больше нескольких пачек, а уже
+    записанные данные сохраняются при аварийном завершении. Вызываемые
+    объекты в очереди выполняются после записи всех предыдущих пачек,
+    None завершает работу. updates_counters - переносит ли sync_counters
+    обновленные счетчики в уже записанные данные.
+    При дозаписи строки, уже имеющиеся в данных (по channel_id и
+    message_id), пропускаются: они остаются, например, от канала, сбор
+    которого прервался до сохранения контрольной точки.
+    """
+    updates_counters = False
+
+    def __init__(self, path, append=False, metrics=None):
+        self.path = path
+        self.append = append
+        self.metrics = metrics
+        self.rows_written = 0
+        self.error = None
+        self._written = None
+        # Дни публикации (YYYY-MM-DD) записанных в этом запуске сообщений
+        self.written_days = set()
+
+    def _write_batch(self, rows):
+        raise NotImplementedError
+
+    def _existing_keys(self):
+        """Ключи (channel_id, message_id) уже записанных строк"""
+        return set()
+
+    def _existing_columns(self):
+        """Колонки уже записанных данных или None, если данных нет"""
+        return None
+
+    def check_columns(self, columns):
+        """Проверяет перед сбором, что строки с колонками columns можно дописать к данным
+
+        Строки дописываются без заголовка и схемы, поэтому при другом наборе
+        колонок (например, после включения MEDIA) выбрасывается ValueError.
+        """
+        if not self.append:
+            return
+        existing = self._existing_columns()
+        if existing is not None and list(existing) != list(columns):
+            raise ValueError(f"Колонки {self.path} ({', '.join(existing)}) не совпадают с собираемыми "
+                             f"({', '.join(columns)}). Укажите новый OUTPUT_PATH")
+
+    def _write_new(self, rows):
+        """Записывает только строки, которых еще нет в данных"""
+        if self.append:
+            if self._written is None:
+                self._written = self._existing_keys()
+            rows = [row for row in rows
+                    if (row['channel_id'], row['message_id']) not in self._written]
+            self._written.update((row['channel_id'], row['message_id']) for row in rows)
+        if rows:
+            self._write_batch(rows)
+            self.written_days.update(row['publication_date'].strftime('%Y-%m-%d') for row in rows)
+
+    async def run(self, queue):
+        """Обрабатывает очередь до получения None
+
+        После ошибки записи очередь продолжает вычитываться без записи,
+        чтобы не блокировать производителей, а ошибка выбрасывается в конце.
+        """
+        try:
+            while True:
+                item = await queue.get()
+                try:
+                    if item is None:
+                        break
+                    if self.error is not None:
+                        continue
+                    try:
+                        if callable(item):
+                            item()
+                        elif self.metrics is not None:
+                            with self.metrics.stage('write'):
+                                await asyncio.to_thread(self._write_new, item)
+                            self.metrics.observe_queue('batches', queue.qsize())
+                        else:
+                            await asyncio.to_thread(self._write_new, item)
+                    except Exception as e:
+                        self.error = e
+                finally:
+                    queue.task_done()
+        finally:
+            self.close()
+        if self.error is not None:
+            raise self.error
+
+    def sync_counters(self, checkpoints, channel_id):
+        """Переносит обновленные счетчики канала в записанные данные, если формат это позволяет"""
+        pass
+
+    def close(self):
+        pass
+
+
+class CsvStreamWriter(StreamWriter):
+    """Потоковая запись собранных сообщений в CSV"""
+
+    def __init__(self, path=STATS_PATH, append=False, metrics=None):
+        super().__init__(path, append, metrics)
+        self._file = None
+
+    def _write_batch(self, rows):
+        if self._file is None:
+            header = True
+            if self.append:
+                # Заголовок нужен только для нового или пустого файла
+                self._file = open(self.path, 'a', newline='', encoding='utf-8')
+                header = self._file.tell() == 0
+            else:
+                self._file = open(self.path, 'w', newline='', encoding='utf-8')
+            pd.DataFrame(rows).to_csv(self._file, index=False, header=header)
+        else:
+            pd.DataFrame(rows).to_csv(self._file, index=False, header=False)
+        self._file.flush()
+        self.rows_written += len(rows)
+
+    def _existing_keys(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return set()
+        df = pd.read_csv(self.path, usecols=['channel_id', 'message_id'])
+        return set(zip(df['channel_id'], df['message_id']))
+
+    def _existing_columns(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        return list(pd.read_csv(self.path, nrows=0).columns)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetStreamWriter(StreamWriter):
+    """Потоковая запись собранных сообщений в набор данных Parquet
+
+    Данные разбиваются на каталоги по университету и дате публикации
+    (university=.../date=YYYY-MM-DD), каждая пачка пишется отдельными
+    файлами. Словарное кодирование включено для всех колонок, кроме
+    текста сообщений. Требуется пакет pyarrow.
+    """
+
+    def __init__(self, path=PARQUET_PATH, append=False, metrics=None):
+        super().__init__(path, append, metrics)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Для записи в Parquet установите пакет pyarrow: pip install pyarrow")
+        # Уникальный префикс файлов, чтобы запуски не перезаписывали друг друга
+        self._run_id = uuid.uuid4().hex
+        self._batches = 0
+
+    def _write_batch(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._batches == 0 and not self.append and os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        df = pd.DataFrame(rows)
+        df['date'] = pd.to_datetime(df['publication_date']).dt.strftime('%Y-%m-%d')
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_to_dataset(
+            table,
+            self.path,
+            partition_cols=PARTITION_COLUMNS,
+            basename_template=f'{self._run_id}-{self._batches}-{{i}}.parquet',
+            existing_data_behavior='overwrite_or_ignore',
+            use_dictionary=[name for name in table.column_names if name != 'message']
+        )
+        self._batches += 1
+        self.rows_written += len(rows)
+
+    def _existing_keys(self):
+        if not os.path.isdir(self.path):
+            return set()
+        df = pd.read_parquet(self.path, columns=['channel_id', 'message_id'])
+        return set(zip(df['channel_id'], df['message_id']))
+
+    def check_columns(self, columns):
+        # Порядок колонок в файлах Parquet не важен, а дата добавляется как раздел
+        super().check_columns(sorted(set(columns) | {'date'}))
+
+    def _existing_columns(self):
+        if not os.path.isdir(self.path):
+            return None
+        import pyarrow.dataset as ds
+        dataset = ds.dataset(self.path, partitioning='hive')
+        return sorted(dataset.schema.names) if dataset.files else None
+
+
+class SqliteStreamWriter(StreamWriter):
+    """Потоковая запись собранных сообщений в хранилище SQLite
+
+    Сообщения сохраняются с ключом (channel_id, message_id), поэтому
+    хранилище накапливает данные всех запусков без повторов независимо
+    от append, а обновленные счетчики записываются поверх старых.
+    """
+    updates_counters = True
+
+    def __init__(self, path=STORE_PATH, append=False, metrics=None):
+        super().__init__(path, append, metrics)
+        self.store = MessageStore(path)
+
+    def _write_batch(self, rows):
+        self.store.upsert_rows(rows)
+        self.rows_written += len(rows)
+
+    def check_columns(self, columns):
+        # Колонки метаданных вложений добавляются в таблицу при необходимости
+        pass
+
+    def _write_new(self, rows):
+        # Повторы исключает ключ таблицы, а повторная запись обновляет текст и счетчики
+        self._write_batch(rows)
+        self.written_days.update(row['publication_date'].strftime('%Y-%m-%d') for row in rows)
+
+    def sync_counters(self, checkpoints, channel_id):
+        self.store.update_counters(channel_id, checkpoints.get_counters(channel_id))
+
+    def close(self):
+        self.store.close()
+
+
+def make_writer(output_format='csv', path=None, append=False, metrics=None):
+    """Создает потоковый писатель для формата output_format"""
+    if output_format == 'csv':
+        return CsvStreamWriter(path or STATS_PATH, append, metrics)
+    if output_format == 'parquet':
+        return ParquetStreamWriter(path or PARQUET_PATH, append, metrics)
+    if output_format == 'sqlite':
+        return SqliteStreamWriter(path or STORE_PATH, append, metrics)
+    raise ValueError(f"Неизвестный формат вывода: {output_format}. Доступны: {', '.join(OUTPUT_FORMATS)}")
+
+
+def _is_sqlite(path):
+    """Является ли файл базой SQLite (проверяется по заголовку, а не по расширению)"""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as file:
+        return file.read(16) == b'SQLite format 3\x00'
+
+
+def load_stats(path=STATS_PATH, columns=None, universities=None, start_date=None, end_date=None):
+    """Загружает собранные данные из CSV, набора данных Parquet или хранилища SQLite
+
+    Для Parquet читаются только колонки columns и разделы, подходящие под
+    фильтры по университетам и датам (строки YYYY-MM-DD включительно),
+    для SQLite фильтры выполняются запросом по индексам.
+    Для CSV фильтры применяются после чтения.
+    """
+    if _is_sqlite(path):
+        store = MessageStore(path)
+        try:
+            return store.load(columns, universities, start_date, end_date)
+        finally:
+            store.close()
+
+    if os.path.isdir(path):
+        filters = []
+        if universities is not None:
+            filters.append(('university', 'in', list(universities)))
+        if start_date is not None:
+            filters.append(('date', '>=', str(start_date)))
+        if end_date is not None:
+            filters.append(('date', '<=', str(end_date)))
+        return pd.read_parquet(path, columns=columns, filters=filters or None)
+
+    # Колонки фильтров читаются, даже если их нет в columns
+    filter_columns = []
+    if universities is not None:
+        filter_columns.append('university')
+    if start_date is not None or end_date is not None:
+        filter_columns.append('publication_date')
+    usecols = list(dict.fromkeys(list(columns) + filter_columns)) if columns else None
+    df = pd.read_csv(path, usecols=usecols)
+    if universities is not None:
+        df = df[df['university'].isin(list(universities))]
+    if start_date is not None or end_date is not None:
+        dates = pd.to_datetime(df['publication_date'].str[:10])
+        mask = pd.Series(True, index=df.index)
+        if start_date is not None:
+            mask &= dates >= pd.Timestamp(str(start_date))
+        if end_date is not None:
+            mask &= dates <= pd.Timestamp(str(end_date))
+        df = df[mask]
+    return df[list(columns)] if columns else df